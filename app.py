@@ -2,293 +2,121 @@
 
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-import os
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-import sqlite3
-import threading
-import time
-
-
-
-# Email Configuration
-EMAIL_HOST = st.secrets["EMAIL_HOST"]
-EMAIL_PORT = int(st.secrets["EMAIL_PORT"])
-EMAIL_HOST_USER = st.secrets["EMAIL_HOST_USER"]
-EMAIL_HOST_PASSWORD = st.secrets["EMAIL_HOST_PASSWORD"]
-DEFAULT_FROM_EMAIL = st.secrets["DEFAULT_FROM_EMAIL"]
-
-def calculate_compound_interest(principal, rate, time, installments):
-    """
-    Calcula juros compostos mensais
-    principal: valor inicial
-    rate: taxa de juros anual em porcentagem
-    time: tempo em meses
-    installments: número de parcelas
-    """
-    # Garantir que installments não seja zero
-    if installments == 0:
-        installments = 1  # Define um valor padrão para evitar divisão por zero
-
-    # Converter taxa anual para mensal
-    monthly_rate = (rate / 100) / 12
-
-    # Calcular montante final com juros compostos mensais
-    amount = principal * (1 + monthly_rate) ** time
-
-    # Calcular valor da parcela
-    if monthly_rate == 0:  # Sem juros
-        monthly_payment = principal / installments
-    else:  # Com juros
-        monthly_payment = principal * (monthly_rate * (1 + monthly_rate) ** installments) / (
-            (1 + monthly_rate) ** installments - 1
-        )
-
+from datetime import datetime
+from emprestimos.amortization import loan_schedule
+from emprestimos.db import (
+    DB_PATH,
+    LATE_CHARGES_TOTALS_SQL,
+    LOAN_PAYMENTS_SQL,
+    OVERDUE_SQL,
+    PORTFOLIO_SUMMARY_SQL,
+    RECEIVABLES_BY_MONTH_SQL,
+    ConnectionManager,
+    create_loans,
+    delete_loan,
+    generation,
+    loan_filters,
+    loan_paid_cents,
+    migrate,
+    pay_due_until,
+    reamortize_loan,
+    record_loan_payment,
+    set_payments_paid,
+)
+from emprestimos.late_fees import LateFeeScheduler
+from emprestimos.mailer import OutboxWorker, enqueue_email
+from emprestimos.metrics import BUCKETS, InstrumentedConnection, registry, timed
+from emprestimos.money import format_brl, from_cents, to_cents
+from emprestimos.pdf_report import create_pdf, pdf_filename
+from emprestimos.reminders import ReminderScheduler
+
+
+
+# Quantidade de empréstimos exibidos por página na lista
+LOANS_PER_PAGE = 20
+
+
+# Configurações lidas de st.secrets no uso, e não na importação do módulo
+def email_settings():
     return {
-        'total_amount': amount,
-        'monthly_payment': monthly_payment,
-        'total_interest': amount - principal
+        'host': st.secrets["EMAIL_HOST"],
+        'port': int(st.secrets["EMAIL_PORT"]),
+        'user': st.secrets["EMAIL_HOST_USER"],
+        'password': st.secrets["EMAIL_HOST_PASSWORD"],
+        'from_email': st.secrets["DEFAULT_FROM_EMAIL"],
+        'use_tls': str(st.secrets.get("EMAIL_USE_TLS", True)).lower() not in ("0", "false", "no"),
     }
 
 
+def debug_panel_enabled():
+    # Instrumentação: painel de depuração na sidebar
+    return str(st.secrets.get("DEBUG_PANEL", False)).lower() in ("1", "true", "yes")
 
 
-def init_db():
-    conn = sqlite3.connect('loans.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS loans
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         client_name TEXT NOT NULL,
-         amount REAL NOT NULL,
-         interest_rate REAL NOT NULL,
-         installments INTEGER NOT NULL,
-         start_date TEXT NOT NULL)
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS payments
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         loan_id INTEGER NOT NULL,
-         installment_number INTEGER NOT NULL,
-         amount REAL NOT NULL,
-         due_date TEXT NOT NULL,
-         paid INTEGER DEFAULT 0,
-         FOREIGN KEY (loan_id) REFERENCES loans (id))
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_pdf(loan_data, payments_data):
-    # Nome do arquivo PDF
-#    filename = f"emprestimo_{loan_data['id']}_{loan_data['client_name']}.pdf"
-    filename = f"loan_{loan_data['id']}_{loan_data['client_name']}.pdf"
-    doc = SimpleDocTemplate(filename, pagesize=letter)
-    elements = []
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = styles['Title']
-    title_style.fontSize = 18
-    title_style.leading = 22
-    title_style.textColor = colors.HexColor('#2F4F4F')
-    
-    normal_style = styles['Normal']
-    normal_style.fontSize = 12
-    normal_style.leading = 16
-    normal_style.spaceAfter = 12
-    
-    # Cabeçalho
-    elements.append(Paragraph(f"Detalhes do Empréstimo - {loan_data['client_name']}", title_style))
-    elements.append(Spacer(1, 12))  # Espaçamento
-    
-    # Informações do empréstimo
-    elements.append(Paragraph(f"Valor do Empréstimo: R${loan_data['amount']:.2f}", normal_style))
-    elements.append(Paragraph(f"Taxa de Juros: {loan_data['interest_rate']}%", normal_style))
-    elements.append(Paragraph(f"Número de Parcelas: {loan_data['installments']}", normal_style))
-    elements.append(Spacer(1, 20))  # Espaçamento maior antes da tabela
-    
-    # Dados da tabela
-    data = [['Parcela', 'Data de Vencimento', 'Valor', 'Status']]
-    for payment in payments_data:
-        data.append([
-            payment['installment_number'],
-            payment['due_date'],
-            f"R${payment['amount']:.2f}",
-            'Pago' if payment['paid'] else 'Pendente'
-        ])
-    
-    # Configuração da tabela
-    table = Table(data, colWidths=[80, 120, 100, 100])
-    table.setStyle(TableStyle([
-        # Cabeçalho
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-        
-        # Corpo
-        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f9f9f9')),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 11),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-        
-        # Linhas alternadas
-        ('BACKGROUND', (0, 2), (-1, -1), colors.HexColor('#ffffff')),
-        ('BACKGROUND', (0, 3), (-1, -1), colors.HexColor('#f2f2f2')),
-        
-        # Grade
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-    ]))
-    
-    elements.append(table)
-    elements.append(Spacer(1, 20))  # Espaçamento após a tabela
-    
-    # Nota final
-    elements.append(Paragraph("Por favor, entre em contato conosco caso tenha dúvidas sobre seu empréstimo.", normal_style))
-    
-    # Construção do PDF
-    doc.build(elements)
-    return filename
+@st.cache_resource
+def get_db():
+    # Um único pool de conexões por processo, compartilhado entre sessões
+    return ConnectionManager(DB_PATH, factory=InstrumentedConnection)
 
 
-def send_email(to_email, subject, body, attachment_path=None):
-    msg = MIMEMultipart()
-    msg['From'] = DEFAULT_FROM_EMAIL
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    
-    msg.attach(MIMEText(body, 'html'))
-    
-    if attachment_path and os.path.exists(attachment_path):
-        with open(attachment_path, 'rb') as f:
-            pdf = MIMEApplication(f.read(), _subtype='pdf')
-            pdf.add_header('Content-Disposition', 'attachment', filename=os.path.basename(attachment_path))
-            msg.attach(pdf)
-    
-    with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-        server.starttls()
-        server.login(EMAIL_HOST_USER, EMAIL_HOST_PASSWORD)
-        server.send_message(msg)
-
-def check_due_payments():
-    while True:
-        conn = sqlite3.connect('loans.db')
-        c = conn.cursor()
-        today = datetime.now().date()
-        
-        c.execute('''
-            SELECT p.*, l.client_name, l.installments
-            FROM payments p
-            JOIN loans l ON p.loan_id = l.id
-            WHERE p.paid = 0 AND date(p.due_date) = date(?)
-        ''', (today.strftime('%Y-%m-%d'),))
-        
-        payments = c.fetchall()
-        for payment in payments:
-            subject = f"Lembrete de Pagamento - Parcela {payment[2]}"
-            body = f"""
-            <html>
-            <head>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    margin: 0;
-                    padding: 0;
-                }}
-                .container {{
-                    max-width: 600px;
-                    margin: 20px auto;
-                    padding: 20px;
-                    background-color: #f9f9f9;
-                    border: 1px solid #ddd;
-                    border-radius: 8px;
-                }}
-                h2 {{
-                    color: #4CAF50;
-                    text-align: center;
-                    margin-bottom: 20px;
-                }}
-                p {{
-                    margin: 10px 0;
-                    font-size: 16px;
-                }}
-                table {{
-                    width: 100%;
-                    border-collapse: collapse;
-                    margin-top: 20px;
-                }}
-                table th, table td {{
-                    border: 1px solid #ddd;
-                    padding: 12px;
-                    text-align: center;
-                }}
-                table th {{
-                    background-color: #4CAF50;
-                    color: white;
-                    font-weight: bold;
-                }}
-                table tr:nth-child(even) {{
-                    background-color: #f2f2f2;
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    text-align: center;
-                    font-size: 14px;
-                    color: #666;
-                }}
-            </style>
-            </head>
-            <body>
-            <div class="container">
-                <h2>Lembrete de Pagamento</h2>
-                <p>Prezado(a) {payment[6]},</p>
-                <p>Este é um lembrete de que o pagamento da sua parcela do empréstimo vence hoje. Seguem os detalhes:</p>
-                <table>
-                    <tr>
-                        <th>Parcela</th>
-                        <th>Data de Vencimento</th>
-                        <th>Valor</th>
-                        <th>Status</th>
-                    </tr>
-                    <tr>
-                        <td>{payment[2]}</td>
-                        <td>{payment[4]}</td>
-                        <td>R${payment[3]:.2f}</td>
-                        <td>Pendente</td>
-                    </tr>
-                </table>
-                <p style="margin-top: 20px;">
-                    Por favor, certifique-se de realizar o pagamento até o final do dia para evitar encargos adicionais.
-                </p>
-                <p>
-                    Em caso de dúvidas, entre em contato com a nossa equipe de suporte.
-                </p>
-                <div class="footer">
-                    <p>Este é um email automático. Não responda a este endereço.</p>
-                </div>
-            </div>
-            </body>
-            </html>
-            """
-            send_email(EMAIL_HOST_USER, subject, body)
-        
-        conn.close()
-        time.sleep(86400)  # Check every 24 hours
+@st.cache_resource
+def init_db():
+    migrate(get_db().connection())
+
+
+@st.cache_resource
+def get_outbox_worker():
+    # Um único worker por processo envia os e-mails enfileirados
+    worker = OutboxWorker(get_db(), email_settings())
+    worker.start()
+    return worker
+
+
+@st.cache_resource
+def get_reminder_scheduler():
+    scheduler = ReminderScheduler(
+        get_db(), email_settings()['user'], on_enqueue=get_outbox_worker().wake
+    )
+    scheduler.start()
+    return scheduler
+
+
+@st.cache_resource
+def get_late_fee_scheduler():
+    # Multa e mora das parcelas em atraso, uma vez por dia
+    scheduler = LateFeeScheduler(get_db())
+    scheduler.start()
+    return scheduler
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def loan_pdf(loan_data, payments_data):
+    # Reaproveita o PDF entre reruns enquanto o empréstimo não mudar
+    return create_pdf(loan_data, payments_data)
+
+
+def show_debug_panel():
+    # Operações desta execução do script: chamadas e faixas de latência
+    rerun = registry.rerun()
+    with st.sidebar.expander("Depuração", expanded=True):
+        if not rerun:
+            st.caption("Nenhuma operação registrada nesta execução.")
+            return
+        labels = [f"≤{bound * 1000:g}ms" if bound != float('inf') else ">2.5s" for bound in BUCKETS]
+        rows = []
+        for operation, histogram in sorted(rerun.items()):
+            row = {
+                'Operação': operation,
+                'Chamadas': histogram.count,
+                'Total (ms)': round(histogram.total * 1000, 2),
+                'Máx (ms)': round(histogram.max * 1000, 2),
+            }
+            row.update(zip(labels, histogram.buckets))
+            rows.append(row)
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+
 
 def main():
+    registry.begin_rerun()
     st.set_page_config(page_title="Zanella's Empréstimos", layout="wide")
 
     # Remover espaço em branco no topo da página e ajustar o título
@@ -361,52 +189,182 @@ def main():
     st.markdown('<div class="main-container">', unsafe_allow_html=True)
     st.markdown("<h2>Zanella's Empréstimos</h2>", unsafe_allow_html=True)
     init_db()
+    get_outbox_worker()
     
-    # Start payment checker in a separate thread
-    if 'payment_checker' not in st.session_state:
-        payment_checker = threading.Thread(target=check_due_payments)
-        payment_checker.daemon = True
-        payment_checker.start()
-        st.session_state.payment_checker = True
+    # Lembretes de vencimento: um único agendador por processo
+    get_reminder_scheduler()
+    get_late_fee_scheduler()
     
     # Sidebar navigation
-    page = st.sidebar.selectbox("Navegação", ["Lista de Empréstimos", "Novo Empréstimo"])
+    page = st.sidebar.selectbox("Navegação", ["Lista de Empréstimos", "Novo Empréstimo", "Painel da Carteira"])
     
     if page == "Lista de Empréstimos":
         show_loans_list()
+    elif page == "Painel da Carteira":
+        show_dashboard()
     else:
         show_new_loan_form()
 
+    # Métricas acumuladas no formato do Prometheus, se configurado
+    metrics_path = st.secrets.get("METRICS_PATH")
+    if metrics_path:
+        registry.write_prometheus(metrics_path)
+    if debug_panel_enabled():
+        show_debug_panel()
 
 
-def delete_loan(loan_id):
-    conn = sqlite3.connect('loans.db')
-    c = conn.cursor()
-    
-    # Remover pagamentos associados ao empréstimo
-    c.execute("DELETE FROM payments WHERE loan_id = ?", (loan_id,))
-    
-    # Remover o empréstimo
-    c.execute("DELETE FROM loans WHERE id = ?", (loan_id,))
-    
-    conn.commit()
-    conn.close()
 
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_loan_count(generation, filters=()):
+    count_sql, _, params = loan_filters(**dict(filters))
+    return get_db().connection().execute(count_sql, params).fetchone()[0]
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_loans_page(generation, page, page_size, filters=()):
+    _, page_sql, params = loan_filters(**dict(filters))
+    params.update(limit=page_size, offset=(page - 1) * page_size)
+    return pd.read_sql_query(page_sql, get_db().connection(), params=params)
+
+
+# Rótulo do filtro de situação -> status de loan_filters
+STATUS_OPTIONS = {
+    "Todos": None,
+    "Em aberto": 'active',
+    "Quitados": 'paid_off',
+    "Em atraso": 'overdue',
+}
 
+
+def loans_list_filters():
+    """
+    Filtros da lista de empréstimos (busca, situação e data de início),
+    como tupla de pares para servir de chave do cache
+    """
+    search_col, status_col, from_col, to_col = st.columns([3, 2, 2, 2])
+    search = search_col.text_input("Buscar cliente", key="loans_search")
+    status = status_col.selectbox("Situação", list(STATUS_OPTIONS), key="loans_status")
+    start_from = from_col.date_input("Início de", value=None, format="DD/MM/YYYY", key="loans_start_from")
+    start_to = to_col.date_input("Início até", value=None, format="DD/MM/YYYY", key="loans_start_to")
+
+    filters = {
+        'search': search.strip() or None,
+        'status': STATUS_OPTIONS[status],
+        'start_from': start_from and start_from.isoformat(),
+        'start_to': start_to and start_to.isoformat(),
+    }
+    if filters['status'] == 'overdue':
+        filters['today'] = datetime.now().strftime('%Y-%m-%d')
+    return tuple((name, value) for name, value in filters.items() if value)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_loan_payments(loan_id, generation):
+    return pd.read_sql_query(LOAN_PAYMENTS_SQL, get_db().connection(), params=(loan_id,))
+
+
+def show_payments_grid(conn, loan_id, payments_df):
+    """
+    Parcelas de um empréstimo em uma única grade editável
+    As alterações da coluna "Pago" são gravadas juntas, em uma transação,
+    ao salvar; o mesmo vale para "pagar tudo até a data". Todas viram
+    eventos no livro de pagamentos.
+    """
+    grid = pd.DataFrame({
+        'id': payments_df['id'],
+        'parcela': payments_df['installment_number'],
+        'vencimento': pd.to_datetime(payments_df['due_date']).dt.strftime('%d/%m/%Y'),
+        'valor': payments_df['amount_cents'].map(format_brl),
+        'valor_pago': payments_df['paid_cents'].map(format_brl),
+        'pago': payments_df['paid'].astype(bool),
+    })
+
+    # A geração entra na chave: após salvar, a grade recomeça sem edições pendentes
+    loan_generation = generation(conn, f"loan:{loan_id}")
+    with st.form(key=f"payments_form_{loan_id}_{loan_generation}", border=False):
+        edited = st.data_editor(
+            grid,
+            column_order=('parcela', 'vencimento', 'valor', 'valor_pago', 'pago'),
+            column_config={
+                'parcela': st.column_config.NumberColumn("Parcela", format="#%d"),
+                'vencimento': st.column_config.TextColumn("Vencimento"),
+                'valor': st.column_config.TextColumn("Valor"),
+                'valor_pago': st.column_config.TextColumn("Valor Pago"),
+                'pago': st.column_config.CheckboxColumn("Pago"),
+            },
+            disabled=('parcela', 'vencimento', 'valor', 'valor_pago'),
+            hide_index=True,
+            key=f"payments_{loan_id}_{loan_generation}",
+        )
+        if st.form_submit_button("Salvar Parcelas"):
+            changed = edited[edited['pago'] != grid['pago']]
+            updated = set_payments_paid(conn, loan_id, zip(changed['id'].tolist(), changed['pago'].tolist()))
+            if updated:
+                st.rerun()
+
+    with st.form(key=f"pay_due_form_{loan_id}", border=False):
+        date_col, button_col = st.columns([2, 1], vertical_alignment="bottom")
+        until = date_col.date_input("Pagar parcelas em aberto até", format="DD/MM/YYYY")
+        if button_col.form_submit_button("Pagar Todas"):
+            if pay_due_until(conn, loan_id, until.isoformat()):
+                st.rerun()
+            st.info("Nenhuma parcela em aberto até essa data.")
+
+    # Pagamento parcial ou adiantado: quita as parcelas em aberto em ordem
+    with st.form(key=f"partial_payment_form_{loan_id}", border=False):
+        amount_col, button_col = st.columns([2, 1], vertical_alignment="bottom")
+        amount = amount_col.number_input("Registrar pagamento (R$)", min_value=0.0, step=10.0)
+        if button_col.form_submit_button("Registrar"):
+            if record_loan_payment(conn, loan_id, to_cents(amount)):
+                st.rerun()
+            st.info("Nenhum valor lançado: informe um valor e verifique se há parcelas em aberto.")
+
+
+@timed('page.show_loans_list')
 def show_loans_list():
-    conn = sqlite3.connect('loans.db')
-    loans_df = pd.read_sql_query("SELECT * FROM loans", conn)
+    # As leituras ficam em cache até que um escritor incremente a geração
+    conn = get_db().connection()
+    portfolio_generation = generation(conn)
     
-    if not loans_df.empty:
+    if cached_loan_count(portfolio_generation):
         st.subheader("Empréstimos Ativos")
+
+        # Busca e filtros aplicados no banco, junto com a paginação
+        filters = loans_list_filters()
+        total_loans = cached_loan_count(portfolio_generation, filters)
+        if not total_loans:
+            st.info("Nenhum empréstimo encontrado")
+            return
+
+        # Paginação no banco: apenas os empréstimos da página atual são lidos
+        total_pages = (total_loans - 1) // LOANS_PER_PAGE + 1
+        page = 1
+        if total_pages > 1:
+            # Volta à primeira página quando os filtros mudam
+            if st.session_state.get("loans_filters") != filters:
+                st.session_state["loans_filters"] = filters
+                st.session_state["loans_page"] = 1
+            page = st.number_input("Página", min_value=1, max_value=total_pages, step=1, key="loans_page")
+        st.caption(f"Página {page} de {total_pages} ({total_loans} empréstimos)")
+
+        loans_df = cached_loans_page(portfolio_generation, page, LOANS_PER_PAGE, filters)
         
         for _, loan in loans_df.iterrows():
-            with st.expander(f"Cliente: {loan['client_name']} - R$ {loan['amount']:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")):
+            expander = st.expander(
+                f"Cliente: {loan['client_name']} - {format_brl(loan['amount_cents'])}",
+                key=f"loan_{loan['id']}",
+                on_change="rerun"
+            )
+            with expander:
+                # Conteúdo (e parcelas) só é carregado quando o expander está aberto
+                if not expander.open:
+                    continue
+
                 # Edição do empréstimo
                 edit_col1, edit_col2, edit_col3 = st.columns(3)
                 new_amount = edit_col1.number_input(
                     "Novo Valor",
-                    value=float(loan['amount']),
+                    value=from_cents(loan['amount_cents']),
                     key=f"amount_{loan['id']}"
                 )
                 new_rate = edit_col2.number_input(
@@ -417,96 +375,115 @@ def show_loans_list():
                 st.markdown("<br>", unsafe_allow_html=True)
                 
                 if edit_col3.button("Atualizar Empréstimo", key=f"update_{loan['id']}"):
-                    c = conn.cursor()
-                    c.execute(
-                        "UPDATE loans SET amount = ?, interest_rate = ? WHERE id = ?",
-                        (new_amount, new_rate, loan['id'])
-                    )
-                    
-                    # Recalcular parcelas
-                    calc = calculate_compound_interest(
-                        new_amount,
-                        new_rate,
-                        loan['installments'],
-                        loan['installments']
-                    )
-                    
-                    c.execute(
-                        "UPDATE payments SET amount = ? WHERE loan_id = ? AND paid = 0",
-                        (calc['monthly_payment'], loan['id'])
-                    )
-                    
-                    conn.commit()
-                    st.success("Empréstimo atualizado com sucesso!")
-                    st.rerun()
+                    # Recalcula apenas as parcelas em aberto a partir do saldo devedor
+                    try:
+                        payment_cents = reamortize_loan(conn, int(loan['id']), to_cents(new_amount), new_rate)
+                    except ValueError as exc:
+                        st.error(f"Não foi possível atualizar: {exc}.")
+                    else:
+                        if payment_cents:
+                            st.success("Empréstimo atualizado com sucesso!")
+                        else:
+                            st.success("Empréstimo atualizado: as parcelas pagas já quitam o novo valor.")
+                        st.rerun()
 
                 # Botão para apagar o empréstimo
                 if st.button(f"Excluir Empréstimo - {loan['client_name']}", key=f"delete_{loan['id']}"):
-                    delete_loan(loan['id'])
-                    st.success(f"Empréstimo de {loan['client_name']} excluído com sucesso!")
-                    st.rerun()
+                    try:
+                        delete_loan(conn, int(loan['id']))
+                    except ValueError as exc:
+                        # O livro de pagamentos não é apagado junto com o empréstimo
+                        st.error(f"Não foi possível excluir: {exc}.")
+                    else:
+                        st.success(f"Empréstimo de {loan['client_name']} excluído com sucesso!")
+                        st.rerun()
                     
                 # Métricas do empréstimo
                 col1, col2, col3, col4 = st.columns(4)
-                col1.metric("Valor Principal", f"R$ {loan['amount']:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+                col1.metric("Valor Principal", format_brl(loan['amount_cents']))
                 col2.metric("Taxa de Juros", f"{loan['interest_rate']:.2f}%")
                 col3.metric("Parcelas", loan['installments'])
                 col4.metric("Data Início", loan['start_date'][:10])
                 
-                payments_df = pd.read_sql_query(
-                    "SELECT * FROM payments WHERE loan_id = ? ORDER BY installment_number",
-                    conn, params=(loan['id'],)
-                )
-                
-                # Cálculo do total pago e restante
-                total_paid = payments_df[payments_df['paid'] == 1]['amount'].sum()
-                total_remaining = payments_df[payments_df['paid'] == 0]['amount'].sum()
-                
+                # Total pago pelo livro de pagamentos (inclui pagamentos parciais);
+                # o total das parcelas já vem agregado da consulta da página
+                paid_cents = loan_paid_cents(conn, int(loan['id']))
                 col1, col2 = st.columns(2)
-                col1.metric("Total Pago", f"R$ {total_paid:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-                col2.metric("Total Restante", f"R$ {total_remaining:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+                col1.metric("Total Pago", format_brl(paid_cents))
+                col2.metric("Total Restante", format_brl(loan['paid_cents'] + loan['remaining_cents'] - paid_cents))
                 st.markdown("<br><br>", unsafe_allow_html=True)
                 
-                st.write("### Parcelas")
-                for _, payment in payments_df.iterrows():
-                    cols = st.columns([1, 2, 2, 2, 3])
-                    cols[0].write(f"#{payment['installment_number']}")
-                    
-                    # Formatação da data para o formato dia/mês/ano
-                    formatted_date = datetime.strptime(payment['due_date'], '%Y-%m-%d').strftime('%d/%m/%Y')
-                    cols[1].write(formatted_date)
-                    
-                    # Formatação do valor com pontos no padrão brasileiro
-                    formatted_amount = f"R$ {payment['amount']:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                    cols[2].write(formatted_amount)
-                    
-                    # Status da parcela (Pago ou Pendente)
-                    status = "🟢 Pago" if payment['paid'] else "🔴 Pendente"
-                    cols[3].write(status)
-                    
-                    # Botão para marcar a parcela como paga ou não paga
-                    if cols[4].button(
-                        "Marcar como Não Pago" if payment['paid'] else "Marcar como Pago",
-                        key=f"btn_{payment['id']}"
-                    ):
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE payments SET paid = ? WHERE id = ?",
-                            (1 - payment['paid'], payment['id'])
-                        )
-                        conn.commit()
-                        st.rerun()
+                payments_df = cached_loan_payments(
+                    int(loan['id']), generation(conn, f"loan:{loan['id']}")
+                )
 
+                loan_data = loan[['id', 'client_name', 'amount_cents', 'interest_rate', 'installments', 'start_date']].to_dict()
+                st.download_button(
+                    "Baixar PDF",
+                    data=loan_pdf(loan_data, payments_df.to_dict('records')),
+                    file_name=pdf_filename(loan_data),
+                    mime="application/pdf",
+                    key=f"pdf_{loan['id']}",
+                    on_click="ignore"
+                )
+                
+                st.write("### Parcelas")
+                show_payments_grid(conn, int(loan['id']), payments_df)
 
-                    
     else:
         st.info("Nenhum empréstimo cadastrado.")
-    
-    conn.close()
 
 
 
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_portfolio_summary(generation, today):
+    # Lê apenas as tabelas de resumo (triggers) e late_charges, nunca as parcelas
+    conn = get_db().connection()
+    summary = conn.execute(PORTFOLIO_SUMMARY_SQL).fetchone() or (0, 0, 0, 0)
+    overdue = conn.execute(OVERDUE_SQL, (today,)).fetchone()
+    late_charges = conn.execute(LATE_CHARGES_TOTALS_SQL, {'today': today}).fetchone()
+    receivables = pd.read_sql_query(RECEIVABLES_BY_MONTH_SQL, conn)
+    return summary, overdue, late_charges, receivables
+
+
+@timed('page.show_dashboard')
+def show_dashboard():
+    st.markdown("<h3>Painel da Carteira</h3>", unsafe_allow_html=True)
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    summary, overdue, late_charges, receivables = cached_portfolio_summary(generation(get_db().connection()), today)
+    loan_count, principal_cents, paid_cents, outstanding_cents = summary
+    overdue_cents, overdue_count = overdue
+    fine_cents, mora_cents, settled_charges_cents = late_charges
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Empréstimos", loan_count)
+    col2.metric("Valor Emprestado", format_brl(principal_cents))
+    col3.metric("Total Recebido", format_brl(paid_cents))
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Saldo em Aberto", format_brl(outstanding_cents))
+    col2.metric("Valor em Atraso", format_brl(overdue_cents))
+    col3.metric("Parcelas em Atraso", overdue_count)
+
+    # Calculadas pelo job diário de atraso (late_fees); os encargos de parcelas
+    # já pagas não entram no total em atraso
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Multas", format_brl(fine_cents))
+    col2.metric("Juros de Mora", format_brl(mora_cents))
+    col3.metric("Total em Atraso com Encargos", format_brl(overdue_cents + fine_cents + mora_cents))
+    col4.metric("Encargos de Parcelas Pagas", format_brl(settled_charges_cents))
+
+    st.write("### Recebíveis por Mês")
+    if receivables.empty:
+        st.info("Nenhuma parcela em aberto.")
+    else:
+        receivables = receivables.assign(amount=receivables['amount_cents'] / 100)
+        st.bar_chart(receivables, x='month', y='amount', x_label="Mês", y_label="Valor (R$)")
+
+
 # Função principal do formulário
+@timed('page.show_new_loan_form')
 def show_new_loan_form():
 
 #    st.subheader("Novo Empréstimo")
@@ -541,27 +518,29 @@ def show_new_loan_form():
             key='installments'
         )
 
+    # Uma única tabela (em cache) para a prévia, o resumo e as parcelas gravadas
+    schedule = None
+    if amount > 0 and installments >= 1:
+        schedule = loan_schedule(
+            to_cents(amount), interest_rate, int(installments), datetime.now().strftime('%Y-%m-%d')
+        )
+
     # 2/4 da página: Tabela de parcelas
     with col2:
         with st.columns([2, 15])[1]:  # Coluna 1: 75% (formulário), Coluna 2: 25% (botão e mensagens)
         #    st.markdown("<br><br>", unsafe_allow_html=True)  # Adiciona dois saltos de linha para afastar as colunas do conteúdo acima
             st.write("### Previsão das Parcelas")
             st.markdown("<br>", unsafe_allow_html=True)
-            if amount > 0 and installments >= 1 and interest_rate > 0:
-                calc = calculate_compound_interest(amount, interest_rate, installments, installments)
-                
-                installment_data = []
-                start_date = datetime.now()
-                for i in range(installments):
-                    due_date = start_date + timedelta(days=(i + 1) * 30)
-                    installment_data.append({
-                        'Parcela': i + 1,
-                        'Vencimento': due_date.strftime('%d/%m/%Y'),
-                        'Valor': f"R$ {calc['monthly_payment']:.2f}"
-                    })
-                
-                df = pd.DataFrame(installment_data)
-                st.dataframe(df, height=250)
+            if schedule and interest_rate > 0:
+                df = pd.DataFrame({
+                    'Parcela': schedule['installment_number'],
+                    'Vencimento': pd.Series(schedule['due_date']).dt.strftime('%d/%m/%Y'),
+                    'Valor': [format_brl(cents) for cents in schedule['installment'].tolist()],
+                    'Juros': [format_brl(cents) for cents in schedule['interest'].tolist()],
+                    'Amortização': [format_brl(cents) for cents in schedule['amortization'].tolist()],
+                    'Saldo': [format_brl(cents) for cents in schedule['balance'].tolist()],
+                })
+                st.dataframe(df, height=250, hide_index=True)
 
 
 
@@ -570,42 +549,22 @@ def show_new_loan_form():
 
         # Botão de criação do empréstimo
         if st.button("Criar Empréstimo"):
-            if client_name and amount > 0 and installments > 0:
-                conn = sqlite3.connect('loans.db')
-                c = conn.cursor()
-                
-                # Create loan
-                c.execute('''
-                    INSERT INTO loans (client_name, amount, interest_rate, installments, start_date)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (client_name, amount, interest_rate, installments, datetime.now().strftime('%Y-%m-%d')))
-                
-                loan_id = c.lastrowid
-                
-                # Create payments
-                monthly_amount = (amount * (1 + interest_rate/100)) / installments
-                calc = calculate_compound_interest(amount, interest_rate, installments, installments)
-                start_date = datetime.now()
-                
-                for i in range(installments):
-                    due_date = start_date + timedelta(days=(i+1)*30)
-                    c.execute('''
-                        INSERT INTO payments (loan_id, installment_number, amount, due_date)
-                        VALUES (?, ?, ?, ?)
-                    ''', (loan_id, i+1, calc['monthly_payment'], due_date.strftime('%Y-%m-%d')))
-                
-                conn.commit()
-                
-                # Get loan and payments data for PDF
-                c.execute("SELECT * FROM loans WHERE id = ?", (loan_id,))
-                loan_data = dict(zip([col[0] for col in c.description], c.fetchone()))
-                
-                c.execute("SELECT * FROM payments WHERE loan_id = ?", (loan_id,))
-                payments_data = [dict(zip([col[0] for col in c.description], row)) for row in c.fetchall()]
+            if client_name and schedule:
+                conn = get_db().connection()
+
+                # Create loan and payments in a single transaction
+                loan_data, payments_data = create_loans(conn, [{
+                    'client_name': client_name,
+                    'amount_cents': to_cents(amount),
+                    'interest_rate': interest_rate,
+                    'installments': installments,
+                    'schedule': schedule,
+                }])[0]
                 
                 # Generate PDF and send email
-                pdf_path = create_pdf(loan_data, payments_data)
+                pdf = create_pdf(loan_data, payments_data)
                 
+                email_user = email_settings()['user']
                 subject = f"Novo Contrato de Empréstimo - {client_name}"
                 body = f"""
                 <!DOCTYPE html>
@@ -644,10 +603,10 @@ def show_new_loan_form():
                     <p>Estamos felizes em confirmar os detalhes do seu novo empréstimo. Por favor, revise as informações abaixo:</p>
 
                     <div class="highlight">
-                        <p><strong>Valor do Empréstimo:</strong> R${amount:.2f}</p>
+                        <p><strong>Valor do Empréstimo:</strong> {format_brl(loan_data['amount_cents'])}</p>
                         <p><strong>Taxa de Juros:</strong> {interest_rate}% ao ano</p>
                         <p><strong>Número de Parcelas:</strong> {installments}</p>
-                        <p><strong>Valor da Parcela Mensal (aproximado):</strong> R${monthly_amount:.2f}</p>
+                        <p><strong>Valor da Parcela Mensal:</strong> {format_brl(schedule['payment'])}</p>
                         <p><strong>Data de Início:</strong> {datetime.now().strftime('%d/%m/%Y')}</p>
                     </div>
 
@@ -657,17 +616,17 @@ def show_new_loan_form():
                     <div class="footer">
                         <p>Atenciosamente,</p>
                         <p><strong>Equipe Financeira</strong></p>
-                        <p>E-mail: {EMAIL_HOST_USER}</p>
+                        <p>E-mail: {email_user}</p>
                         <p>Telefone: (62)9 8295-7089</p>
                     </div>
                 </body>
                 </html>
                 """
                 
-                send_email(EMAIL_HOST_USER, subject, body, pdf_path)
-                os.remove(pdf_path)  # Clean up PDF file
+                # O envio acontece em segundo plano; aqui apenas enfileiramos
+                enqueue_email(conn, email_user, subject, body, pdf, pdf_filename(loan_data))
+                get_outbox_worker().wake()
                 
-                conn.close()
                 st.success("Empréstimo criado com sucesso!")
                 st.rerun()
             else:
@@ -686,13 +645,11 @@ def show_new_loan_form():
     # Metade inferior: Resultados em tempo real
 #    st.write("### Resumo do Empréstimo")
     col3, col4, col5, col6 = st.columns(4)
-    if amount > 0 and installments > 0 and interest_rate > 0:
-        calc = calculate_compound_interest(amount, interest_rate, installments, installments)
-        
-        col3.metric("Valor Principal", f"R$ {amount:,.2f}")
-        col4.metric("Valor Total com Juros", f"R$ {calc['total_amount']:,.2f}")
-        col5.metric("Valor dos Juros", f"R$ {calc['total_interest']:,.2f}")
-        col6.metric("Valor da Parcela", f"R$ {calc['monthly_payment']:,.2f}")
+    if schedule and interest_rate > 0:
+        col3.metric("Valor Principal", format_brl(to_cents(amount)))
+        col4.metric("Valor Total com Juros", format_brl(schedule['total_cents']))
+        col5.metric("Valor dos Juros", format_brl(schedule['interest_cents']))
+        col6.metric("Valor da Parcela", format_brl(schedule['payment']))
     
     
 
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from emprestimos.amortization import calculate_compound_interest
+from emprestimos.db import (
+    COUNT_LOANS_SQL,
+    DUE_PAYMENTS_SQL,
+    LOAN_PAYMENTS_SQL,
+    LOANS_PAGE_SQL,
+    create_loans,
+    generation,
+    loan_filters,
+    migrate,
+)
+from emprestimos.pdf_report import create_pdf
+from synthetic_db import SIZES, build_database
+
+
+BASELINE_PATH = 'benchmark_baseline.json'
+
+# Mesmo tamanho de página da lista de empréstimos do app
+LOANS_PER_PAGE = 20
+
+# Módulos importados por workers e scripts; o tempo de importação deve ficar baixo
+IMPORT_MODULES = (
+    'emprestimos',
+    'emprestimos.archive',
+    'emprestimos.db',
+    'emprestimos.late_fees',
+    'emprestimos.mailer',
+    'emprestimos.pdf_report',
+    'emprestimos.reminders',
+    'emprestimos.amortization',
+    'juros_composto',
+)
+
+
+def measure(fn, repeat=5, number=1):
+    """
+    Executa fn `number` vezes por rodada, em `repeat` rodadas
+    Retorna min, mediana e média do tempo por chamada, em milissegundos.
+    """
+    fn()  # aquecimento: caches do SQLite, imports tardios do reportlab
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) * 1000 / number)
+    return {
+        'min_ms': round(min(timings), 4),
+        'median_ms': round(statistics.median(timings), 4),
+        'mean_ms': round(statistics.fmean(timings), 4),
+        'calls': repeat * number,
+    }
+
+
+def bench_compound_interest(conn):
+    return lambda: calculate_compound_interest(10000, 12, 36, 36), 200
+
+
+def bench_create_loans(conn):
+    # 10 empréstimos de 36 parcelas por chamada (360 parcelas inseridas)
+    loans = [
+        {'client_name': f"Benchmark {i}", 'amount_cents': 1_000_000, 'interest_rate': 12.0, 'installments': 36}
+        for i in range(10)
+    ]
+    return lambda: create_loans(conn, loans), 1
+
+
+def bench_loans_list(conn):
+    # Consultas de uma renderização de show_loans_list com um empréstimo aberto
+    total = conn.execute(COUNT_LOANS_SQL).fetchone()[0]
+    last_offset = max(total - 1, 0) // LOANS_PER_PAGE * LOANS_PER_PAGE
+    loan_id = conn.execute('SELECT MIN(id) FROM loans').fetchone()[0]
+
+    def run():
+        generation(conn)
+        conn.execute(COUNT_LOANS_SQL).fetchone()
+        pd.read_sql_query(LOANS_PAGE_SQL, conn, params=(LOANS_PER_PAGE, 0))
+        pd.read_sql_query(LOANS_PAGE_SQL, conn, params=(LOANS_PER_PAGE, last_offset))
+        generation(conn, f"loan:{loan_id}")
+        pd.read_sql_query(LOAN_PAYMENTS_SQL, conn, params=(loan_id,))
+    return run, 10
+
+
+def bench_loans_search(conn):
+    # Busca por prefixo do nome combinada com filtro de situação e de data
+    count_sql, page_sql, params = loan_filters(
+        search='clien 12', status='overdue', start_from='2024-06-01', today='2025-08-01'
+    )
+    params.update(limit=LOANS_PER_PAGE, offset=0)
+
+    def run():
+        conn.execute(count_sql, params).fetchone()
+        conn.execute(page_sql, params).fetchall()
+    return run, 10
+
+
+def bench_due_payments(conn):
+    # O dia com mais parcelas em aberto
+    row = conn.execute(
+        'SELECT due_date FROM receivables_daily ORDER BY open_count DESC LIMIT 1'
+    ).fetchone()
+    day = row[0] if row else datetime.now().strftime('%Y-%m-%d')
+    return lambda: conn.execute(DUE_PAYMENTS_SQL, (day,)).fetchall(), 20
+
+
+def bench_create_pdf(conn):
+    conn.row_factory = sqlite3.Row
+    loan = dict(conn.execute(
+        'SELECT id, client_name, amount_cents, interest_rate, installments, start_date '
+        'FROM loans ORDER BY installments DESC, id LIMIT 1'
+    ).fetchone())
+    payments = [dict(row) for row in conn.execute(LOAN_PAYMENTS_SQL, (loan['id'],))]
+    conn.row_factory = None
+    return lambda: create_pdf(loan, payments), 1
+
+
+BENCHMARKS = {
+    'calculate_compound_interest': bench_compound_interest,
+    'create_loans': bench_create_loans,
+    'loans_list_queries': bench_loans_list,
+    'loans_search_query': bench_loans_search,
+    'due_payments_query': bench_due_payments,
+    'create_pdf': bench_create_pdf,
+}
+
+
+def measure_import(module, repeat=5):
+    """
+    Tempo de importação de um módulo em um interpretador novo, sem contar a
+    inicialização do Python. Mesmo formato de measure.
+    """
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    root = os.path.dirname(os.path.abspath(__file__))
+    timings = [
+        float(subprocess.run(
+            [sys.executable, '-c', code], cwd=root, check=True, capture_output=True, text=True
+        ).stdout) * 1000
+        for _ in range(repeat)
+    ]
+    return {
+        'min_ms': round(min(timings), 4),
+        'median_ms': round(statistics.median(timings), 4),
+        'mean_ms': round(statistics.fmean(timings), 4),
+        'calls': repeat,
+    }
+
+
+def run_imports(repeat=5):
+    results = {}
+    for module in IMPORT_MODULES:
+        results[module] = measure_import(module, repeat)
+        print(f"  {'import':>6} {module:<27} {results[module]['median_ms']:>10.3f} ms", file=sys.stderr)
+    return results
+
+
+def fixture_path(fixtures_dir, size):
+    """
+    Caminho do banco sintético de um tamanho, gerado na primeira vez
+    """
+    path = os.path.join(fixtures_dir, f"loans_{size}.db")
+    if not os.path.exists(path):
+        print(f"Gerando banco sintético {path}...", file=sys.stderr)
+        build_database(path, SIZES[size]).close()
+    return path
+
+
+def run_size(fixtures_dir, size, names=None, repeat=5):
+    """
+    Executa os benchmarks sobre uma cópia do banco de um tamanho, para que
+    as escritas (create_loans) não alterem o banco sintético
+    """
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'loans.db')
+    shutil.copy(fixture_path(fixtures_dir, size), path)
+    conn = sqlite3.connect(path)
+    migrate(conn)
+
+    results = {}
+    try:
+        for name in names or BENCHMARKS:
+            fn, number = BENCHMARKS[name](conn)
+            results[name] = measure(fn, repeat, number)
+            print(f"  {size:>5} {name:<28} {results[name]['median_ms']:>10.3f} ms", file=sys.stderr)
+    finally:
+        conn.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def environment():
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compara as medianas com as do baseline
+    Retorna a lista de regressões (tamanho, benchmark, baseline, atual) acima
+    da tolerância relativa.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, current in benchmarks.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if previous and current['median_ms'] > previous['median_ms'] * (1 + tolerance):
+                regressions.append((size, name, previous['median_ms'], current['median_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks dos caminhos críticos do app")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES),
+                        help="tamanhos do banco sintético (padrão: todos)")
+    parser.add_argument('--bench', nargs='+', choices=list(BENCHMARKS), default=None,
+                        help="benchmarks a executar (padrão: todos)")
+    parser.add_argument('--repeat', type=int, default=5, help="rodadas por benchmark")
+    parser.add_argument('--no-imports', action='store_true', help="não mede o tempo de importação")
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'loans_benchmark'),
+                        help="pasta dos bancos sintéticos (padrão: %(default)s)")
+    parser.add_argument('--save', metavar='JSON', nargs='?', const=BASELINE_PATH,
+                        help="grava os resultados como baseline (padrão: %(const)s)")
+    parser.add_argument('--compare', metavar='JSON', nargs='?', const=BASELINE_PATH,
+                        help="compara com um baseline e falha se houver regressão")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="aumento relativo da mediana aceito na comparação")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.fixtures, exist_ok=True)
+    results = {size: run_size(args.fixtures, size, args.bench, args.repeat) for size in args.sizes}
+    if not args.no_imports:
+        # Medidos como um "tamanho" à parte para que compare os trate igual
+        results['imports'] = run_imports(args.repeat)
+    report = {'environment': environment(), 'results': results}
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Baseline gravado em {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for size, name, previous, current in regressions:
+            print(f"REGRESSÃO {size} {name}: {previous:.3f} ms -> {current:.3f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+        print('OK: nenhuma regressão acima da tolerância', file=sys.stderr)
+    elif not args.save:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import sys
+
+import numpy as np
+
+from emprestimos.amortization import annual_to_monthly_rate, price_schedule_cents
+
+
+def main(samples=20000, seed=0):
+    """
+    Verifica as tabelas Price em centavos com empréstimos aleatórios (até
+    R$ 100 milhões, 360 parcelas e taxas de quase zero a 1000% ao ano): todas
+    as parcelas, exceto a última, são iguais à parcela calculada, a última
+    difere dela em até 2 centavos e as amortizações somam o principal
+    """
+    rng = np.random.default_rng(int(seed))
+    samples = int(samples)
+    principal = rng.integers(1, 10**10, samples)
+    # Metade das taxas até 1000% ao ano, a outra metade de 0,000001% a 1%
+    rate = np.where(np.arange(samples) % 2 == 0,
+                    rng.uniform(0, 1000, samples), 10 ** rng.uniform(-6, 0, samples))
+    installments = rng.integers(1, 361, samples)
+
+    schedule = price_schedule_cents(principal, annual_to_monthly_rate(rate), installments)
+    k = np.arange(1, schedule['installment'].shape[1] + 1)
+    regular = k < installments[:, None]
+    wrong = np.any(regular & (schedule['installment'] != schedule['payment'][:, None]), axis=1)
+    last = schedule['installment'][np.arange(samples), installments - 1]
+    wrong |= np.abs(last - schedule['payment']) > 2
+    wrong |= schedule['amortization'].sum(axis=1) != principal
+    wrong |= np.any((schedule['interest'] < 0) | (schedule['balance'] < 0), axis=1)
+
+    for i in np.flatnonzero(wrong)[:10]:
+        print(f"FALHA: {principal[i]} centavos, {rate[i]:.4f}% ao ano, {installments[i]} parcelas")
+    ok = not wrong.any()
+    print(f"OK: {samples} tabelas verificadas" if ok else f"FALHA: {int(wrong.sum())} de {samples} tabelas")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
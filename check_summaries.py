@@ -0,0 +1,143 @@
+import sqlite3
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from emprestimos.db import (create_loans, delete_payment, migrate, reamortize_loan,
+                            record_loan_payment, toggle_payment)
+
+
+# Resumos recalculados a partir das parcelas, comparados com os mantidos pelos triggers
+LOAN_SUMMARY_DIFF_SQL = '''
+    WITH expected AS (
+        SELECT l.id AS loan_id,
+               COALESCE(SUM(CASE WHEN p.paid THEN p.amount_cents END), 0) AS paid_cents,
+               COALESCE(SUM(CASE WHEN NOT p.paid THEN p.amount_cents END), 0) AS remaining_cents,
+               COUNT(CASE WHEN p.paid THEN 1 END) AS paid_count,
+               COUNT(CASE WHEN NOT p.paid THEN 1 END) AS open_count
+        FROM loans l LEFT JOIN payments p ON p.loan_id = l.id
+        GROUP BY l.id
+    )
+    SELECT 'loan_summary', e.loan_id, e.paid_cents, e.remaining_cents, e.paid_count, e.open_count,
+           s.paid_cents, s.remaining_cents, s.paid_count, s.open_count
+    FROM expected e LEFT JOIN loan_summary s USING (loan_id)
+    WHERE s.loan_id IS NULL OR (e.paid_cents, e.remaining_cents, e.paid_count, e.open_count)
+        != (s.paid_cents, s.remaining_cents, s.paid_count, s.open_count)
+'''
+
+PORTFOLIO_SUMMARY_DIFF_SQL = '''
+    WITH expected AS (
+        SELECT (SELECT COUNT(*) FROM loans) AS loan_count,
+               (SELECT COALESCE(SUM(amount_cents), 0) FROM loans) AS principal_cents,
+               (SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE paid) AS paid_cents,
+               (SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE NOT paid) AS outstanding_cents
+    )
+    SELECT 'portfolio_summary', e.*, s.loan_count, s.principal_cents, s.paid_cents, s.outstanding_cents
+    FROM expected e, portfolio_summary s
+    WHERE s.id = 1 AND (e.loan_count, e.principal_cents, e.paid_cents, e.outstanding_cents)
+        != (s.loan_count, s.principal_cents, s.paid_cents, s.outstanding_cents)
+'''
+
+RECEIVABLES_DAILY_DIFF_SQL = '''
+    WITH expected AS (
+        SELECT due_date, SUM(amount_cents) AS open_cents, COUNT(*) AS open_count
+        FROM payments WHERE NOT paid GROUP BY due_date
+    ),
+    dates AS (SELECT due_date FROM expected UNION SELECT due_date FROM receivables_daily)
+    SELECT 'receivables_daily', d.due_date, e.open_cents, e.open_count, r.open_cents, r.open_count
+    FROM dates d
+    LEFT JOIN expected e USING (due_date)
+    LEFT JOIN receivables_daily r USING (due_date)
+    WHERE e.due_date IS NULL OR r.due_date IS NULL
+        OR (e.open_cents, e.open_count) != (r.open_cents, r.open_count)
+'''
+
+# Parcelas cujo total pago não confere com o livro de pagamentos ou com paid, ou
+# excede o valor da parcela (pagamento absorvido por uma re-amortização)
+LEDGER_DIFF_SQL = '''
+    SELECT 'payments', p.id, p.paid_cents, COALESCE(SUM(e.amount_cents), 0), p.paid, p.amount_cents
+    FROM payments p LEFT JOIN payment_events e ON e.payment_id = p.id
+    GROUP BY p.id
+    HAVING p.paid_cents != COALESCE(SUM(e.amount_cents), 0) OR p.paid != (p.paid_cents >= p.amount_cents)
+        OR p.paid_cents > p.amount_cents
+'''
+
+
+def summary_mismatches(conn):
+    """
+    Retorna as linhas dos resumos (e das parcelas) que diferem dos valores
+    recalculados a partir das parcelas e do livro de pagamentos
+    """
+    rows = []
+    for sql in (LOAN_SUMMARY_DIFF_SQL, PORTFOLIO_SUMMARY_DIFF_SQL, RECEIVABLES_DAILY_DIFF_SQL, LEDGER_DIFF_SQL):
+        rows.extend(conn.execute(sql).fetchall())
+    return rows
+
+
+def random_operation(conn, rng):
+    """
+    Aplica ao banco uma operação aleatória: novo empréstimo, pagamento (total
+    ou parcial), estorno, exclusão de parcela ou re-amortização
+    Operações recusadas (ValueError) também são válidas: o banco não muda.
+    """
+    loan_ids = [row[0] for row in conn.execute('SELECT id FROM loans')]
+    payment_ids = [row[0] for row in conn.execute('SELECT id FROM payments')]
+    kind = rng.integers(6) if loan_ids else 0
+    try:
+        if kind == 0:
+            create_loans(conn, [{
+                'client_name': f"Cliente {len(loan_ids) + 1}",
+                'amount_cents': int(rng.integers(1000, 10**7)),
+                'interest_rate': float(rng.choice([0.0, 12.0, rng.uniform(0, 200)])),
+                'installments': int(rng.integers(1, 25)),
+                'start_date': datetime(2025, 1, 1 + int(rng.integers(28))),
+            }])
+        elif kind == 1:
+            record_loan_payment(conn, int(rng.choice(loan_ids)), int(rng.integers(1, 10**6)))
+        elif kind == 2 and payment_ids:
+            toggle_payment(conn, int(rng.choice(payment_ids)), bool(rng.integers(2)))
+        elif kind == 3 and payment_ids:
+            delete_payment(conn, int(rng.choice(payment_ids)))
+        else:
+            reamortize_loan(conn, int(rng.choice(loan_ids)),
+                            int(rng.integers(1000, 10**7)), float(rng.uniform(0, 100)))
+        return 'ok'
+    except ValueError:
+        return 'recusada'
+
+
+def main(path=None, operations=3000, seed=0):
+    """
+    Verifica que loan_summary, portfolio_summary e receivables_daily conferem
+    com os agregados recalculados a partir das parcelas
+    path: banco a verificar; sem path, a verificação é feita após cada uma de
+    `operations` operações aleatórias em um banco em memória
+    """
+    if path not in (None, '', '-'):
+        conn = sqlite3.connect(path)
+        migrate(conn)
+        wrong = summary_mismatches(conn)
+        for row in wrong[:10]:
+            print(f"FALHA: {row}")
+        print("OK: resumos conferem" if not wrong else f"FALHA: {len(wrong)} linhas divergentes")
+        return 0 if not wrong else 1
+
+    rng = np.random.default_rng(int(seed))
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    counts = {'ok': 0, 'recusada': 0}
+    for i in range(int(operations)):
+        counts[random_operation(conn, rng)] += 1
+        wrong = summary_mismatches(conn)
+        if wrong:
+            for row in wrong[:10]:
+                print(f"FALHA: {row}")
+            print(f"FALHA: resumos divergentes após a operação {i + 1}")
+            return 1
+    print(f"OK: {counts['ok']} operações ({counts['recusada']} recusadas) com resumos conferidos")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""
+Núcleo do sistema de empréstimos: cálculo Price, banco, PDF, e-mail, lembretes e jobs diários
+
+Importar o pacote não carrega nenhum submódulo: os nomes abaixo são
+resolvidos no primeiro acesso (emprestimos.create_pdf importa pdf_report,
+que só importa o reportlab ao gerar o primeiro PDF). Assim workers, testes
+e scripts pagam apenas pelo que usam.
+"""
+import importlib
+
+
+# Nome público -> submódulo que o define
+_EXPORTS = {
+    'annual_to_monthly_rate': 'amortization',
+    'calculate_compound_interest': 'amortization',
+    'due_dates': 'amortization',
+    'loan_schedule': 'amortization',
+    'price_payment': 'amortization',
+    'price_schedule': 'amortization',
+    'price_schedule_cents': 'amortization',
+    'reamortize': 'amortization',
+    'schedule_rows': 'amortization',
+    'archive_settled_loans': 'archive',
+    'format_brl': 'money',
+    'from_cents': 'money',
+    'to_cents': 'money',
+    'DB_PATH': 'db',
+    'ConnectionManager': 'db',
+    'bump_generation': 'db',
+    'create_loans': 'db',
+    'delete_loan': 'db',
+    'delete_payment': 'db',
+    'generation': 'db',
+    'loan_filters': 'db',
+    'loan_paid_cents': 'db',
+    'migrate': 'db',
+    'pay_due_until': 'db',
+    'reamortize_loan': 'db',
+    'record_loan_payment': 'db',
+    'set_payments_paid': 'db',
+    'toggle_payment': 'db',
+    'InstrumentedConnection': 'metrics',
+    'registry': 'metrics',
+    'timed': 'metrics',
+    'create_pdf': 'pdf_report',
+    'pdf_filename': 'pdf_report',
+    'LateFeeScheduler': 'late_fees',
+    'run_late_fees': 'late_fees',
+    'OutboxWorker': 'mailer',
+    'build_message': 'mailer',
+    'enqueue_email': 'mailer',
+    'ReminderScheduler': 'reminders',
+    'render_reminders': 'reminders',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,272 @@
+import functools
+
+import numpy as np
+
+from .money import round_half_up
+
+
+def annual_to_monthly_rate(rate):
+    """
+    Converte taxa de juros anual (em porcentagem) para taxa mensal decimal
+    """
+    return (np.asarray(rate, dtype=np.float64) / 100) / 12
+
+
+def price_payment(principal, monthly_rate, installments):
+    """
+    Calcula o valor da parcela pelo Sistema Price para vários empréstimos
+    principal: valores iniciais
+    monthly_rate: taxas de juros mensais (decimal)
+    installments: números de parcelas
+    """
+    principal = np.asarray(principal, dtype=np.float64)
+    monthly_rate = np.asarray(monthly_rate, dtype=np.float64)
+    # Garantir que installments não seja zero
+    installments = np.maximum(np.asarray(installments, dtype=np.int64), 1)
+
+    # P * r / (1 - (1+r)^-n), com expm1/log1p: (1+r)^n - 1 perde a precisão
+    # com taxas muito baixas e (1+r)^n estoura com taxas muito altas
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payment = principal * monthly_rate / -np.expm1(-installments * np.log1p(monthly_rate))
+
+    # Sem juros: parcelas iguais
+    return np.where(monthly_rate == 0, principal / installments, payment)
+
+
+def price_schedule(principal, monthly_rate, installments):
+    """
+    Gera as tabelas Price completas de vários empréstimos em uma única chamada
+    principal: valores iniciais
+    monthly_rate: taxas de juros mensais (decimal)
+    installments: números de parcelas
+
+    Retorna um dicionário com arrays de formato (empréstimos x parcelas):
+    installment (valor da parcela), interest (juros), amortization e balance
+    (saldo devedor após a parcela). Posições além do número de parcelas de
+    cada empréstimo ficam zeradas.
+    """
+    principal, monthly_rate, installments = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(principal, dtype=np.float64)),
+        np.atleast_1d(np.asarray(monthly_rate, dtype=np.float64)),
+        np.atleast_1d(np.maximum(np.asarray(installments, dtype=np.int64), 1)),
+    )
+    payment = price_payment(principal, monthly_rate, installments)
+
+    max_installments = int(installments.max()) if installments.size else 0
+    k = np.arange(1, max_installments + 1)
+    r = monthly_rate[:, None]
+
+    # Saldo devedor após k parcelas: valor presente das n - k parcelas
+    # restantes, PMT * (1 - (1+r)^-(n-k)) / r. Ao contrário de
+    # P(1+r)^k - PMT * ((1+r)^k - 1) / r, não subtrai dois valores enormes e
+    # quase iguais, o que destruía a precisão com taxas altas e prazos longos
+    remaining = np.maximum(installments[:, None] - k, 0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        annuity = np.where(r == 0, remaining.astype(np.float64), -np.expm1(-remaining * np.log1p(r)) / r)
+    balance = payment[:, None] * annuity
+
+    previous_balance = np.empty_like(balance)
+    previous_balance[:, :1] = principal[:, None]
+    previous_balance[:, 1:] = balance[:, :-1]
+
+    interest = previous_balance * r
+    amortization = payment[:, None] - interest
+
+    active = k <= installments[:, None]
+    # A última parcela quita o saldo; elimina resíduos de ponto flutuante
+    balance[k == installments[:, None]] = 0.0
+    balance = np.where(active, np.maximum(balance, 0.0), 0.0)
+
+    return {
+        'payment': payment,
+        'installments': installments,
+        'installment': np.where(active, payment[:, None], 0.0),
+        'interest': np.where(active, interest, 0.0),
+        'amortization': np.where(active, amortization, 0.0),
+        'balance': balance,
+    }
+
+
+def price_schedule_cents(principal_cents, monthly_rate, installments):
+    """
+    Tabelas Price em centavos inteiros (int64) para vários empréstimos
+    principal_cents: valores iniciais em centavos
+    monthly_rate: taxas de juros mensais (decimal)
+    installments: números de parcelas
+
+    Regras de arredondamento (0,5 para cima): o saldo devedor de cada mês é o
+    saldo exato arredondado para o centavo, e a amortização é a diferença
+    entre saldos consecutivos, então a soma das amortizações é exatamente o
+    principal. A parcela regular é a parcela exata arredondada (para cima
+    quando os juros do mês não chegam a meio centavo, para que a amortização
+    nunca passe da parcela); os juros são a parcela menos a amortização. A
+    última parcela é o saldo restante mais os juros do mês e absorve a
+    diferença de arredondamento, limitada a 2 centavos da parcela regular.
+    Sem juros, cada parcela é a própria amortização.
+    Retorna um dicionário com as mesmas chaves de price_schedule.
+    """
+    principal_cents = np.atleast_1d(np.asarray(principal_cents, dtype=np.int64))
+    # Mesma tabela em ponto flutuante, em unidades de centavo
+    exact = price_schedule(principal_cents.astype(np.float64), monthly_rate, installments)
+    installments = exact['installments']
+    principal_cents = np.broadcast_to(principal_cents, installments.shape)
+    monthly_rate = np.broadcast_to(np.asarray(monthly_rate, dtype=np.float64), installments.shape)
+
+    balance = round_half_up(exact['balance'])
+    k = np.arange(1, balance.shape[1] + 1)
+    active = k <= installments[:, None]
+    last = k == installments[:, None]
+
+    previous_balance = np.empty_like(balance)
+    previous_balance[:, :1] = principal_cents[:, None]
+    previous_balance[:, 1:] = balance[:, :-1]
+    amortization = np.where(active, previous_balance - balance, 0)
+
+    # Se a amortização de algum mês passa da parcela arredondada (juros de
+    # menos de meio centavo), a parcela é arredondada para cima: os saldos
+    # caem menos que a parcela exata a cada mês, então a amortização não passa dela
+    payment = round_half_up(exact['payment'])
+    overflow = np.any(active & ~last & (amortization > payment[:, None]), axis=1)
+    payment = np.where(overflow, np.ceil(exact['payment']).astype(np.int64), payment)
+
+    r = monthly_rate[:, None]
+    interest = np.maximum(payment[:, None] - amortization, 0)
+    # Juros da última parcela sobre o saldo arredondado; com taxas muito altas
+    # o arredondamento do saldo é multiplicado por (1+r), então a diferença
+    # para a parcela regular é limitada a 2 centavos
+    last_interest = np.clip(
+        round_half_up(previous_balance * r),
+        np.maximum(payment[:, None] - 2 - amortization, 0),
+        np.maximum(payment[:, None] + 2 - amortization, 0),
+    )
+    interest = np.where(last, last_interest, interest)
+    interest = np.where(active & (r > 0), interest, 0)
+
+    return {
+        'payment': payment,
+        'installments': installments,
+        'installment': interest + amortization,
+        'interest': interest,
+        'amortization': amortization,
+        'balance': balance,
+    }
+
+
+def reamortize(principal_cents, monthly_rate, paid_numbers, paid_cents, remaining):
+    """
+    Recalcula as parcelas em aberto de um empréstimo alterado
+    principal_cents: valor do empréstimo em centavos
+    monthly_rate: taxa de juros mensal (decimal)
+    paid_numbers: números das parcelas já pagas
+    paid_cents: valores efetivamente pagos nessas parcelas, em centavos
+    remaining: quantidade de parcelas em aberto
+
+    O saldo devedor após a última parcela paga (k) é o principal capitalizado
+    até k menos os pagamentos capitalizados da data de cada um até k; esse
+    saldo, arredondado para o centavo, é amortizado pelo Price nas parcelas
+    restantes.
+    Retorna (saldo devedor em centavos, tabela de price_schedule_cents). O saldo
+    é negativo quando os pagamentos excedem o valor; a tabela é a de saldo zero.
+    """
+    paid_numbers = np.asarray(paid_numbers, dtype=np.int64)
+    paid_cents = np.asarray(paid_cents, dtype=np.float64)
+    last_paid = int(paid_numbers.max()) if paid_numbers.size else 0
+
+    growth = (1 + monthly_rate) ** (last_paid - paid_numbers)
+    balance = principal_cents * (1 + monthly_rate) ** last_paid - float(np.sum(paid_cents * growth))
+    balance_cents = int(round_half_up(balance))
+
+    return balance_cents, price_schedule_cents(max(balance_cents, 0), monthly_rate, max(remaining, 1))
+
+
+def schedule_rows(schedule, index=0):
+    """
+    Converte a tabela de um empréstimo do resultado de price_schedule (ou de
+    price_schedule_cents, mantendo os centavos inteiros) em uma lista de
+    dicionários, uma entrada por parcela
+    """
+    n = int(schedule['installments'][index])
+    return [
+        {
+            'installment_number': i + 1,
+            'installment': schedule['installment'][index, i].item(),
+            'interest': schedule['interest'][index, i].item(),
+            'amortization': schedule['amortization'][index, i].item(),
+            'balance': schedule['balance'][index, i].item(),
+        }
+        for i in range(n)
+    ]
+
+
+def due_dates(start_dates, installments):
+    """
+    Vencimentos das parcelas de vários empréstimos, a cada 30 dias da data de início
+    start_dates: datas de início ('YYYY-MM-DD', date ou datetime)
+    installments: número de colunas (a maior quantidade de parcelas)
+    Retorna um array datetime64[D] (empréstimos x parcelas).
+    """
+    start_dates = np.asarray(start_dates, dtype='datetime64[D]')
+    return start_dates[:, None] + 30 * np.arange(1, installments + 1)
+
+
+@functools.lru_cache(maxsize=64)
+def loan_schedule(amount_cents, interest_rate, installments, start_date):
+    """
+    Tabela Price de um empréstimo, com vencimentos, guardada em cache (LRU)
+    amount_cents: valor em centavos
+    interest_rate: taxa de juros anual em porcentagem
+    start_date: data de início ('YYYY-MM-DD')
+
+    A mesma tabela serve a prévia, o resumo e as parcelas gravadas por
+    create_loans; os arrays são somente leitura porque são compartilhados.
+    Retorna um dicionário com installment_number, due_date (datetime64[D]),
+    installment, interest, amortization e balance (centavos, int64) e os
+    totais payment, total_cents e interest_cents.
+    """
+    schedule = price_schedule_cents(amount_cents, annual_to_monthly_rate(interest_rate), installments)
+    n = int(schedule['installments'][0])
+    table = {
+        'installment_number': np.arange(1, n + 1),
+        'due_date': due_dates([start_date], n)[0],
+        'installment': schedule['installment'][0, :n],
+        'interest': schedule['interest'][0, :n],
+        'amortization': schedule['amortization'][0, :n],
+        'balance': schedule['balance'][0, :n],
+    }
+    for column in table.values():
+        column.flags.writeable = False
+    table.update(
+        start_date=start_date,
+        payment=int(schedule['payment'][0]),
+        total_cents=int(table['installment'].sum()),
+        interest_cents=int(table['interest'].sum()),
+    )
+    return table
+
+
+def calculate_compound_interest(principal, rate, time, installments):
+    """
+    Calcula juros compostos mensais
+    principal: valor inicial
+    rate: taxa de juros anual em porcentagem
+    time: tempo em meses
+    installments: número de parcelas
+    """
+    # Garantir que installments não seja zero
+    if installments == 0:
+        installments = 1  # Define um valor padrão para evitar divisão por zero
+
+    # Converter taxa anual para mensal
+    monthly_rate = float(annual_to_monthly_rate(rate))
+
+    # Calcular montante final com juros compostos mensais
+    amount = principal * (1 + monthly_rate) ** time
+
+    # Calcular valor da parcela
+    monthly_payment = float(price_payment(principal, monthly_rate, installments))
+
+    return {
+        'total_amount': amount,
+        'monthly_payment': monthly_payment,
+        'total_interest': amount - principal
+    }
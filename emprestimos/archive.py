@@ -0,0 +1,268 @@
+import argparse
+import os
+import sqlite3
+from datetime import date, timedelta
+
+from .db import DB_PATH, bump_generation, migrate
+from .metrics import timed
+
+
+# Banco de arquivo ao lado do banco principal; pode ser alterado pela
+# variável de ambiente LOANS_ARCHIVE_PATH
+ARCHIVE_PATH = os.environ.get('LOANS_ARCHIVE_PATH') or f"{os.path.splitext(DB_PATH)[0]}_archive.db"
+
+# Esquema do banco de arquivo (anexado como "archive"); as linhas mantêm os ids originais
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS archive.loans
+    (id INTEGER PRIMARY KEY,
+     client_name TEXT NOT NULL,
+     amount_cents INTEGER NOT NULL,
+     interest_rate REAL NOT NULL,
+     installments INTEGER NOT NULL,
+     start_date TEXT NOT NULL,
+     archived_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.payments
+    (id INTEGER PRIMARY KEY,
+     loan_id INTEGER NOT NULL,
+     installment_number INTEGER NOT NULL,
+     amount_cents INTEGER NOT NULL,
+     due_date TEXT NOT NULL,
+     paid INTEGER NOT NULL,
+     paid_cents INTEGER NOT NULL DEFAULT 0)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS archive.idx_payments_loan
+    ON payments (loan_id, installment_number)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.loan_edits
+    (id INTEGER PRIMARY KEY,
+     loan_id INTEGER NOT NULL,
+     edited_at TEXT NOT NULL,
+     old_amount_cents INTEGER NOT NULL,
+     new_amount_cents INTEGER NOT NULL,
+     old_rate REAL NOT NULL,
+     new_rate REAL NOT NULL,
+     from_installment INTEGER NOT NULL,
+     balance_cents INTEGER NOT NULL,
+     payment_cents INTEGER NOT NULL)
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_loan_edits_loan ON loan_edits (loan_id, id)',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.payment_events
+    (id INTEGER PRIMARY KEY,
+     loan_id INTEGER NOT NULL,
+     payment_id INTEGER,
+     kind TEXT NOT NULL,
+     amount_cents INTEGER NOT NULL,
+     created_at TEXT NOT NULL)
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_payment_events_loan ON payment_events (loan_id, id)',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.late_charges
+    (payment_id INTEGER PRIMARY KEY,
+     loan_id INTEGER NOT NULL,
+     due_date TEXT NOT NULL,
+     amount_cents INTEGER NOT NULL,
+     fine_cents INTEGER NOT NULL,
+     mora_daily_rate REAL NOT NULL,
+     processed_on TEXT NOT NULL,
+     settled_on TEXT,
+     mora_cents INTEGER NOT NULL DEFAULT 0,
+     mora_since TEXT)
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_late_charges_loan ON late_charges (loan_id)',
+    'CREATE TEMP TABLE IF NOT EXISTS archive_batch (loan_id INTEGER PRIMARY KEY)',
+    'CREATE TEMP TABLE IF NOT EXISTS archive_stale (loan_id INTEGER PRIMARY KEY)',
+)
+
+# Próximo lote de empréstimos quitados cuja última parcela venceu antes de :before
+SELECT_SETTLED_BATCH = '''
+    INSERT INTO temp.archive_batch (loan_id)
+    SELECT s.loan_id
+    FROM loan_summary s
+    WHERE s.loan_id > :after AND s.open_count = 0 AND s.paid_count > 0
+      AND (SELECT MAX(due_date) FROM payments WHERE loan_id = s.loan_id) < :before
+    ORDER BY s.loan_id
+    LIMIT :batch_size
+'''
+
+# Cópia idempotente, gravada no arquivo em uma transação própria antes das
+# exclusões: um lote interrompido em qualquer ponto pode ser refeito
+COPY_BATCH = (
+    '''
+    INSERT OR REPLACE INTO archive.loans
+        (id, client_name, amount_cents, interest_rate, installments, start_date)
+    SELECT id, client_name, amount_cents, interest_rate, installments, start_date
+    FROM loans WHERE id IN (SELECT loan_id FROM temp.archive_batch)
+    ''',
+    '''
+    INSERT OR REPLACE INTO archive.payments
+        (id, loan_id, installment_number, amount_cents, due_date, paid, paid_cents)
+    SELECT id, loan_id, installment_number, amount_cents, due_date, paid, paid_cents
+    FROM payments WHERE loan_id IN (SELECT loan_id FROM temp.archive_batch)
+    ''',
+    '''
+    INSERT OR IGNORE INTO archive.payment_events
+    SELECT id, loan_id, payment_id, kind, amount_cents, created_at
+    FROM payment_events WHERE loan_id IN (SELECT loan_id FROM temp.archive_batch)
+    ''',
+    '''
+    INSERT OR IGNORE INTO archive.loan_edits
+    SELECT id, loan_id, edited_at, old_amount_cents, new_amount_cents, old_rate, new_rate,
+           from_installment, balance_cents, payment_cents
+    FROM loan_edits WHERE loan_id IN (SELECT loan_id FROM temp.archive_batch)
+    ''',
+    # Multa e mora das parcelas pagas em atraso (payments_late_delete as exclui)
+    '''
+    INSERT OR REPLACE INTO archive.late_charges
+        (payment_id, loan_id, due_date, amount_cents, fine_cents, mora_daily_rate, processed_on,
+         settled_on, mora_cents, mora_since)
+    SELECT payment_id, loan_id, due_date, amount_cents, fine_cents, mora_daily_rate, processed_on,
+           settled_on, mora_cents, mora_since
+    FROM late_charges WHERE loan_id IN (SELECT loan_id FROM temp.archive_batch)
+    ''',
+)
+
+# Empréstimos do lote que mudaram entre a cópia e a exclusão (um pagamento
+# estornado, por exemplo): continuam no banco principal e a cópia é descartada
+SELECT_STALE_BATCH = '''
+    INSERT INTO temp.archive_stale (loan_id)
+    SELECT loan_id FROM temp.archive_batch b
+    WHERE b.loan_id NOT IN (SELECT id FROM archive.loans)
+       OR EXISTS (SELECT 1 FROM main.payments p
+                  WHERE p.loan_id = b.loan_id
+                    AND NOT EXISTS (SELECT 1 FROM archive.payments a
+                                    WHERE a.id = p.id AND a.amount_cents = p.amount_cents
+                                      AND a.paid_cents = p.paid_cents))
+       OR EXISTS (SELECT 1 FROM main.payment_events e
+                  WHERE e.loan_id = b.loan_id
+                    AND NOT EXISTS (SELECT 1 FROM archive.payment_events a WHERE a.id = e.id))
+       OR EXISTS (SELECT 1 FROM main.loan_edits e
+                  WHERE e.loan_id = b.loan_id
+                    AND NOT EXISTS (SELECT 1 FROM archive.loan_edits a WHERE a.id = e.id))
+       OR EXISTS (SELECT 1 FROM main.late_charges c
+                  WHERE c.loan_id = b.loan_id
+                    AND NOT EXISTS (SELECT 1 FROM archive.late_charges a
+                                    WHERE a.payment_id = c.payment_id
+                                      AND a.settled_on IS c.settled_on AND a.mora_cents = c.mora_cents))
+'''
+
+DISCARD_STALE = tuple(
+    f'DELETE FROM archive.{table} WHERE {column} IN (SELECT loan_id FROM temp.archive_stale)'
+    for table, column in (
+        ('loans', 'id'), ('payments', 'loan_id'), ('payment_events', 'loan_id'),
+        ('loan_edits', 'loan_id'), ('late_charges', 'loan_id'),
+    )
+) + ('DELETE FROM temp.archive_batch WHERE loan_id IN (SELECT loan_id FROM temp.archive_stale)',)
+
+# Os triggers de resumo e da busca acompanham as exclusões; os eventos de
+# pagamento e as fotografias saem com o empréstimo (loans_events_delete) e os
+# encargos de atraso com as parcelas (payments_late_delete)
+DELETE_BATCH = (
+    'DELETE FROM main.payments WHERE loan_id IN (SELECT loan_id FROM temp.archive_batch)',
+    'DELETE FROM main.loan_edits WHERE loan_id IN (SELECT loan_id FROM temp.archive_batch)',
+    'DELETE FROM main.loans WHERE id IN (SELECT loan_id FROM temp.archive_batch)',
+)
+
+
+def attach_archive(conn, path=ARCHIVE_PATH):
+    """
+    Anexa o banco de arquivo como "archive", criando as tabelas se preciso
+    """
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+    # Arquivos criados antes do livro de pagamentos
+    columns = [row[1] for row in conn.execute('PRAGMA archive.table_info(payments)')]
+    if 'paid_cents' not in columns:
+        conn.execute('ALTER TABLE archive.payments ADD COLUMN paid_cents INTEGER NOT NULL DEFAULT 0')
+        conn.execute('UPDATE archive.payments SET paid_cents = amount_cents WHERE paid')
+    conn.commit()
+
+
+@timed('job.archive')
+def archive_settled_loans(conn, path=ARCHIVE_PATH, min_age_days=90, batch_size=500, today=None):
+    """
+    Move os empréstimos quitados para o banco de arquivo, em lotes
+    min_age_days: só arquiva empréstimos cuja última parcela venceu há mais
+                  desses dias (os quitados recentemente continuam na lista)
+    batch_size: empréstimos por lote; cada lote é copiado para o arquivo
+                em uma transação e excluído do banco principal em outra
+
+    Em WAL o SQLite não grava os bancos anexados atomicamente (o principal é
+    gravado primeiro), então cópia e exclusão não podem ficar na mesma
+    transação: uma falha entre as duas gravações perderia as cópias. A
+    exclusão só alcança os empréstimos cuja cópia no arquivo continua igual
+    ao banco principal; se o processo cair antes dela, a próxima execução
+    copia o lote de novo e o exclui.
+    O painel e a lista passam a considerar só a carteira ativa.
+    Retorna o número de empréstimos arquivados.
+    """
+    before = ((today or date.today()) - timedelta(days=min_age_days)).isoformat()
+    attach_archive(conn, path)
+    archived = 0
+    last_id = 0
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM temp.archive_batch')
+                conn.execute(SELECT_SETTLED_BATCH, {'after': last_id, 'before': before, 'batch_size': batch_size})
+                loan_ids = [row[0] for row in conn.execute('SELECT loan_id FROM temp.archive_batch')]
+                if not loan_ids:
+                    conn.rollback()
+                    break
+                for statement in COPY_BATCH:
+                    conn.execute(statement)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            last_id = loan_ids[-1]
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM temp.archive_stale')
+                conn.execute(SELECT_STALE_BATCH)
+                for statement in DISCARD_STALE:
+                    conn.execute(statement)
+                confirmed = [row[0] for row in conn.execute('SELECT loan_id FROM temp.archive_batch')]
+                if confirmed:
+                    for statement in DELETE_BATCH:
+                        conn.execute(statement)
+                    bump_generation(conn, confirmed)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            archived += len(confirmed)
+    finally:
+        conn.execute('DETACH DATABASE archive')
+    return archived
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Arquiva os empréstimos quitados em um banco separado")
+    parser.add_argument('--db', default=DB_PATH, help="banco de dados (padrão: %(default)s)")
+    parser.add_argument('--archive', default=ARCHIVE_PATH, help="banco de arquivo (padrão: %(default)s)")
+    parser.add_argument('--min-age-days', type=int, default=90,
+                        help="dias desde o último vencimento para arquivar (padrão: %(default)s)")
+    parser.add_argument('--batch-size', type=int, default=500, help="empréstimos por transação")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        migrate(conn)
+        archived = archive_settled_loans(conn, args.archive, args.min_age_days, args.batch_size)
+    finally:
+        conn.close()
+    print(f"{archived} empréstimos arquivados em {args.archive}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,1425 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+
+# Caminho do banco; pode ser alterado pela variável de ambiente LOANS_DB_PATH
+DB_PATH = os.environ.get('LOANS_DB_PATH', 'loans.db')
+
+# Migrações do esquema, aplicadas em ordem e registradas em PRAGMA user_version.
+# Nunca altere uma migração já publicada; acrescente uma nova ao final.
+MIGRATIONS = [
+    # 1: tabelas iniciais
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS loans
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         client_name TEXT NOT NULL,
+         amount REAL NOT NULL,
+         interest_rate REAL NOT NULL,
+         installments INTEGER NOT NULL,
+         start_date TEXT NOT NULL)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS payments
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         loan_id INTEGER NOT NULL,
+         installment_number INTEGER NOT NULL,
+         amount REAL NOT NULL,
+         due_date TEXT NOT NULL,
+         paid INTEGER DEFAULT 0,
+         FOREIGN KEY (loan_id) REFERENCES loans (id))
+        ''',
+    ),
+    # 2: índices de cobertura para parcelas por empréstimo e por vencimento
+    (
+        '''
+        CREATE INDEX IF NOT EXISTS idx_payments_loan
+        ON payments (loan_id, installment_number, amount, due_date, paid)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_payments_due
+        ON payments (paid, due_date, loan_id, installment_number, amount)
+        ''',
+    ),
+    # 3: fila de e-mails enviada em segundo plano (mailer.OutboxWorker)
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS outbox
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         to_email TEXT NOT NULL,
+         subject TEXT NOT NULL,
+         body TEXT NOT NULL,
+         attachment BLOB,
+         attachment_name TEXT,
+         status TEXT NOT NULL DEFAULT 'pending',
+         attempts INTEGER NOT NULL DEFAULT 0,
+         next_attempt_at REAL NOT NULL DEFAULT 0,
+         last_error TEXT,
+         created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+         sent_at TEXT)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (status, next_attempt_at)
+        ''',
+    ),
+    # 4: marca d'água e lock dos jobs diários, e lembretes já enviados
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS job_runs
+        (job TEXT PRIMARY KEY,
+         last_run_date TEXT,
+         locked_by TEXT,
+         locked_until REAL NOT NULL DEFAULT 0)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reminders_sent
+        (payment_id INTEGER NOT NULL,
+         due_date TEXT NOT NULL,
+         sent_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+         PRIMARY KEY (payment_id, due_date))
+        ''',
+    ),
+    # 5: contadores de geração que invalidam os caches de leitura
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS cache_generation
+        (scope TEXT PRIMARY KEY,
+         generation INTEGER NOT NULL DEFAULT 0)
+        ''',
+    ),
+    # 6: resumos por empréstimo, da carteira e recebíveis por dia, mantidos por triggers
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS loan_summary
+        (loan_id INTEGER PRIMARY KEY,
+         total_paid REAL NOT NULL DEFAULT 0,
+         total_remaining REAL NOT NULL DEFAULT 0,
+         paid_count INTEGER NOT NULL DEFAULT 0,
+         open_count INTEGER NOT NULL DEFAULT 0)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS portfolio_summary
+        (id INTEGER PRIMARY KEY CHECK (id = 1),
+         loan_count INTEGER NOT NULL DEFAULT 0,
+         principal_total REAL NOT NULL DEFAULT 0,
+         total_paid REAL NOT NULL DEFAULT 0,
+         outstanding REAL NOT NULL DEFAULT 0)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS receivables_daily
+        (due_date TEXT PRIMARY KEY,
+         open_amount REAL NOT NULL DEFAULT 0,
+         open_count INTEGER NOT NULL DEFAULT 0)
+        ''',
+        # Carga inicial a partir dos dados existentes
+        '''
+        INSERT INTO loan_summary (loan_id, total_paid, total_remaining, paid_count, open_count)
+        SELECT l.id,
+               COALESCE(SUM(CASE WHEN p.paid THEN p.amount END), 0),
+               COALESCE(SUM(CASE WHEN NOT p.paid THEN p.amount END), 0),
+               COUNT(CASE WHEN p.paid THEN 1 END),
+               COUNT(CASE WHEN NOT p.paid THEN 1 END)
+        FROM loans l LEFT JOIN payments p ON p.loan_id = l.id
+        GROUP BY l.id
+        ''',
+        '''
+        INSERT INTO portfolio_summary (id, loan_count, principal_total, total_paid, outstanding)
+        SELECT 1,
+               (SELECT COUNT(*) FROM loans),
+               (SELECT COALESCE(SUM(amount), 0) FROM loans),
+               (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE paid),
+               (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE NOT paid)
+        ''',
+        '''
+        INSERT INTO receivables_daily (due_date, open_amount, open_count)
+        SELECT due_date, SUM(amount), COUNT(*) FROM payments WHERE NOT paid GROUP BY due_date
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS loans_summary_insert AFTER INSERT ON loans
+        BEGIN
+            INSERT OR IGNORE INTO loan_summary (loan_id) VALUES (NEW.id);
+            UPDATE portfolio_summary
+            SET loan_count = loan_count + 1, principal_total = principal_total + NEW.amount
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS loans_summary_update AFTER UPDATE OF amount ON loans
+        BEGIN
+            UPDATE portfolio_summary
+            SET principal_total = principal_total - OLD.amount + NEW.amount
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS loans_summary_delete AFTER DELETE ON loans
+        BEGIN
+            DELETE FROM loan_summary WHERE loan_id = OLD.id;
+            UPDATE portfolio_summary
+            SET loan_count = loan_count - 1, principal_total = principal_total - OLD.amount
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS payments_summary_insert AFTER INSERT ON payments
+        BEGIN
+            INSERT INTO loan_summary (loan_id, total_paid, total_remaining, paid_count, open_count)
+            VALUES (NEW.loan_id,
+                    CASE WHEN NEW.paid THEN NEW.amount ELSE 0 END,
+                    CASE WHEN NEW.paid THEN 0 ELSE NEW.amount END,
+                    NEW.paid != 0, NEW.paid = 0)
+            ON CONFLICT (loan_id) DO UPDATE SET
+                total_paid = total_paid + excluded.total_paid,
+                total_remaining = total_remaining + excluded.total_remaining,
+                paid_count = paid_count + excluded.paid_count,
+                open_count = open_count + excluded.open_count;
+            UPDATE portfolio_summary SET
+                total_paid = total_paid + CASE WHEN NEW.paid THEN NEW.amount ELSE 0 END,
+                outstanding = outstanding + CASE WHEN NEW.paid THEN 0 ELSE NEW.amount END
+            WHERE id = 1;
+            INSERT INTO receivables_daily (due_date, open_amount, open_count)
+            SELECT NEW.due_date, NEW.amount, 1 WHERE NOT NEW.paid
+            ON CONFLICT (due_date) DO UPDATE SET
+                open_amount = open_amount + excluded.open_amount,
+                open_count = open_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS payments_summary_delete AFTER DELETE ON payments
+        BEGIN
+            UPDATE loan_summary SET
+                total_paid = total_paid - CASE WHEN OLD.paid THEN OLD.amount ELSE 0 END,
+                total_remaining = total_remaining - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount END,
+                paid_count = paid_count - (OLD.paid != 0),
+                open_count = open_count - (OLD.paid = 0)
+            WHERE loan_id = OLD.loan_id;
+            UPDATE portfolio_summary SET
+                total_paid = total_paid - CASE WHEN OLD.paid THEN OLD.amount ELSE 0 END,
+                outstanding = outstanding - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount END
+            WHERE id = 1;
+            UPDATE receivables_daily SET
+                open_amount = open_amount - OLD.amount,
+                open_count = open_count - 1
+            WHERE due_date = OLD.due_date AND NOT OLD.paid;
+            DELETE FROM receivables_daily WHERE due_date = OLD.due_date AND open_count <= 0;
+        END
+        ''',
+        # Atualização = remove a linha antiga dos resumos e soma a nova
+        '''
+        CREATE TRIGGER IF NOT EXISTS payments_summary_update
+        AFTER UPDATE OF loan_id, amount, due_date, paid ON payments
+        BEGIN
+            UPDATE loan_summary SET
+                total_paid = total_paid - CASE WHEN OLD.paid THEN OLD.amount ELSE 0 END,
+                total_remaining = total_remaining - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount END,
+                paid_count = paid_count - (OLD.paid != 0),
+                open_count = open_count - (OLD.paid = 0)
+            WHERE loan_id = OLD.loan_id;
+            UPDATE loan_summary SET
+                total_paid = total_paid + CASE WHEN NEW.paid THEN NEW.amount ELSE 0 END,
+                total_remaining = total_remaining + CASE WHEN NEW.paid THEN 0 ELSE NEW.amount END,
+                paid_count = paid_count + (NEW.paid != 0),
+                open_count = open_count + (NEW.paid = 0)
+            WHERE loan_id = NEW.loan_id;
+            UPDATE portfolio_summary SET
+                total_paid = total_paid
+                    - CASE WHEN OLD.paid THEN OLD.amount ELSE 0 END
+                    + CASE WHEN NEW.paid THEN NEW.amount ELSE 0 END,
+                outstanding = outstanding
+                    - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount END
+                    + CASE WHEN NEW.paid THEN 0 ELSE NEW.amount END
+            WHERE id = 1;
+            UPDATE receivables_daily SET
+                open_amount = open_amount - OLD.amount,
+                open_count = open_count - 1
+            WHERE due_date = OLD.due_date AND NOT OLD.paid;
+            DELETE FROM receivables_daily WHERE due_date = OLD.due_date AND open_count <= 0;
+            INSERT INTO receivables_daily (due_date, open_amount, open_count)
+            SELECT NEW.due_date, NEW.amount, 1 WHERE NOT NEW.paid
+            ON CONFLICT (due_date) DO UPDATE SET
+                open_amount = open_amount + excluded.open_amount,
+                open_count = open_count + 1;
+        END
+        ''',
+    ),
+    # 7: histórico de alterações com o ponto de re-amortização
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS loan_edits
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         loan_id INTEGER NOT NULL,
+         edited_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+         old_amount REAL NOT NULL,
+         new_amount REAL NOT NULL,
+         old_rate REAL NOT NULL,
+         new_rate REAL NOT NULL,
+         from_installment INTEGER NOT NULL,
+         balance REAL NOT NULL,
+         payment REAL NOT NULL)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_loan_edits_loan ON loan_edits (loan_id, id)
+        ''',
+    ),
+    # 8: valores em centavos inteiros (INTEGER) em vez de REAL.
+    # As tabelas são recriadas em vez de usar DROP COLUMN, que exige SQLite 3.35.
+    (
+        'DROP TRIGGER IF EXISTS loans_summary_insert',
+        'DROP TRIGGER IF EXISTS loans_summary_update',
+        'DROP TRIGGER IF EXISTS loans_summary_delete',
+        'DROP TRIGGER IF EXISTS payments_summary_insert',
+        'DROP TRIGGER IF EXISTS payments_summary_delete',
+        'DROP TRIGGER IF EXISTS payments_summary_update',
+        'DROP TABLE IF EXISTS loan_summary',
+        'DROP TABLE IF EXISTS portfolio_summary',
+        'DROP TABLE IF EXISTS receivables_daily',
+        '''
+        CREATE TABLE loans_new
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         client_name TEXT NOT NULL,
+         amount_cents INTEGER NOT NULL,
+         interest_rate REAL NOT NULL,
+         installments INTEGER NOT NULL,
+         start_date TEXT NOT NULL)
+        ''',
+        # ROUND(x, 6) antes de arredondar para o centavo evita 1.005 * 100 = 100.4999...
+        '''
+        INSERT INTO loans_new (id, client_name, amount_cents, interest_rate, installments, start_date)
+        SELECT id, client_name, CAST(ROUND(ROUND(amount * 100, 6)) AS INTEGER),
+               interest_rate, installments, start_date
+        FROM loans
+        ''',
+        '''
+        CREATE TABLE payments_new
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         loan_id INTEGER NOT NULL,
+         installment_number INTEGER NOT NULL,
+         amount_cents INTEGER NOT NULL,
+         due_date TEXT NOT NULL,
+         paid INTEGER DEFAULT 0,
+         FOREIGN KEY (loan_id) REFERENCES loans (id))
+        ''',
+        '''
+        INSERT INTO payments_new (id, loan_id, installment_number, amount_cents, due_date, paid)
+        SELECT id, loan_id, installment_number, CAST(ROUND(ROUND(amount * 100, 6)) AS INTEGER),
+               due_date, paid
+        FROM payments
+        ''',
+        '''
+        CREATE TABLE loan_edits_new
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         loan_id INTEGER NOT NULL,
+         edited_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+         old_amount_cents INTEGER NOT NULL,
+         new_amount_cents INTEGER NOT NULL,
+         old_rate REAL NOT NULL,
+         new_rate REAL NOT NULL,
+         from_installment INTEGER NOT NULL,
+         balance_cents INTEGER NOT NULL,
+         payment_cents INTEGER NOT NULL)
+        ''',
+        '''
+        INSERT INTO loan_edits_new
+        (id, loan_id, edited_at, old_amount_cents, new_amount_cents, old_rate, new_rate,
+         from_installment, balance_cents, payment_cents)
+        SELECT id, loan_id, edited_at,
+               CAST(ROUND(ROUND(old_amount * 100, 6)) AS INTEGER),
+               CAST(ROUND(ROUND(new_amount * 100, 6)) AS INTEGER),
+               old_rate, new_rate, from_installment,
+               CAST(ROUND(ROUND(balance * 100, 6)) AS INTEGER),
+               CAST(ROUND(ROUND(payment * 100, 6)) AS INTEGER)
+        FROM loan_edits
+        ''',
+        # Preserva os contadores de AUTOINCREMENT (ids de linhas já excluídas)
+        '''
+        UPDATE sqlite_sequence
+        SET seq = MAX(seq, COALESCE((SELECT s.seq FROM sqlite_sequence s
+                                     WHERE s.name = substr(sqlite_sequence.name, 1,
+                                                           length(sqlite_sequence.name) - 4)), 0))
+        WHERE name IN ('loans_new', 'payments_new', 'loan_edits_new')
+        ''',
+        'DROP TABLE loans',
+        'DROP TABLE payments',
+        'DROP TABLE loan_edits',
+        'ALTER TABLE loans_new RENAME TO loans',
+        'ALTER TABLE payments_new RENAME TO payments',
+        'ALTER TABLE loan_edits_new RENAME TO loan_edits',
+        '''
+        CREATE INDEX idx_payments_loan
+        ON payments (loan_id, installment_number, amount_cents, due_date, paid)
+        ''',
+        '''
+        CREATE INDEX idx_payments_due
+        ON payments (paid, due_date, loan_id, installment_number, amount_cents)
+        ''',
+        'CREATE INDEX idx_loan_edits_loan ON loan_edits (loan_id, id)',
+        '''
+        CREATE TABLE loan_summary
+        (loan_id INTEGER PRIMARY KEY,
+         paid_cents INTEGER NOT NULL DEFAULT 0,
+         remaining_cents INTEGER NOT NULL DEFAULT 0,
+         paid_count INTEGER NOT NULL DEFAULT 0,
+         open_count INTEGER NOT NULL DEFAULT 0)
+        ''',
+        '''
+        CREATE TABLE portfolio_summary
+        (id INTEGER PRIMARY KEY CHECK (id = 1),
+         loan_count INTEGER NOT NULL DEFAULT 0,
+         principal_cents INTEGER NOT NULL DEFAULT 0,
+         paid_cents INTEGER NOT NULL DEFAULT 0,
+         outstanding_cents INTEGER NOT NULL DEFAULT 0)
+        ''',
+        '''
+        CREATE TABLE receivables_daily
+        (due_date TEXT PRIMARY KEY,
+         open_cents INTEGER NOT NULL DEFAULT 0,
+         open_count INTEGER NOT NULL DEFAULT 0)
+        ''',
+        '''
+        INSERT INTO loan_summary (loan_id, paid_cents, remaining_cents, paid_count, open_count)
+        SELECT l.id,
+               COALESCE(SUM(CASE WHEN p.paid THEN p.amount_cents END), 0),
+               COALESCE(SUM(CASE WHEN NOT p.paid THEN p.amount_cents END), 0),
+               COUNT(CASE WHEN p.paid THEN 1 END),
+               COUNT(CASE WHEN NOT p.paid THEN 1 END)
+        FROM loans l LEFT JOIN payments p ON p.loan_id = l.id
+        GROUP BY l.id
+        ''',
+        '''
+        INSERT INTO portfolio_summary (id, loan_count, principal_cents, paid_cents, outstanding_cents)
+        SELECT 1,
+               (SELECT COUNT(*) FROM loans),
+               (SELECT COALESCE(SUM(amount_cents), 0) FROM loans),
+               (SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE paid),
+               (SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE NOT paid)
+        ''',
+        '''
+        INSERT INTO receivables_daily (due_date, open_cents, open_count)
+        SELECT due_date, SUM(amount_cents), COUNT(*) FROM payments WHERE NOT paid GROUP BY due_date
+        ''',
+        '''
+        CREATE TRIGGER loans_summary_insert AFTER INSERT ON loans
+        BEGIN
+            INSERT OR IGNORE INTO loan_summary (loan_id) VALUES (NEW.id);
+            UPDATE portfolio_summary
+            SET loan_count = loan_count + 1, principal_cents = principal_cents + NEW.amount_cents
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER loans_summary_update AFTER UPDATE OF amount_cents ON loans
+        BEGIN
+            UPDATE portfolio_summary
+            SET principal_cents = principal_cents - OLD.amount_cents + NEW.amount_cents
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER loans_summary_delete AFTER DELETE ON loans
+        BEGIN
+            DELETE FROM loan_summary WHERE loan_id = OLD.id;
+            UPDATE portfolio_summary
+            SET loan_count = loan_count - 1, principal_cents = principal_cents - OLD.amount_cents
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER payments_summary_insert AFTER INSERT ON payments
+        BEGIN
+            INSERT INTO loan_summary (loan_id, paid_cents, remaining_cents, paid_count, open_count)
+            VALUES (NEW.loan_id,
+                    CASE WHEN NEW.paid THEN NEW.amount_cents ELSE 0 END,
+                    CASE WHEN NEW.paid THEN 0 ELSE NEW.amount_cents END,
+                    NEW.paid != 0, NEW.paid = 0)
+            ON CONFLICT (loan_id) DO UPDATE SET
+                paid_cents = paid_cents + excluded.paid_cents,
+                remaining_cents = remaining_cents + excluded.remaining_cents,
+                paid_count = paid_count + excluded.paid_count,
+                open_count = open_count + excluded.open_count;
+            UPDATE portfolio_summary SET
+                paid_cents = paid_cents + CASE WHEN NEW.paid THEN NEW.amount_cents ELSE 0 END,
+                outstanding_cents = outstanding_cents + CASE WHEN NEW.paid THEN 0 ELSE NEW.amount_cents END
+            WHERE id = 1;
+            INSERT INTO receivables_daily (due_date, open_cents, open_count)
+            SELECT NEW.due_date, NEW.amount_cents, 1 WHERE NOT NEW.paid
+            ON CONFLICT (due_date) DO UPDATE SET
+                open_cents = open_cents + excluded.open_cents,
+                open_count = open_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER payments_summary_delete AFTER DELETE ON payments
+        BEGIN
+            UPDATE loan_summary SET
+                paid_cents = paid_cents - CASE WHEN OLD.paid THEN OLD.amount_cents ELSE 0 END,
+                remaining_cents = remaining_cents - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount_cents END,
+                paid_count = paid_count - (OLD.paid != 0),
+                open_count = open_count - (OLD.paid = 0)
+            WHERE loan_id = OLD.loan_id;
+            UPDATE portfolio_summary SET
+                paid_cents = paid_cents - CASE WHEN OLD.paid THEN OLD.amount_cents ELSE 0 END,
+                outstanding_cents = outstanding_cents - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount_cents END
+            WHERE id = 1;
+            UPDATE receivables_daily SET
+                open_cents = open_cents - OLD.amount_cents,
+                open_count = open_count - 1
+            WHERE due_date = OLD.due_date AND NOT OLD.paid;
+            DELETE FROM receivables_daily WHERE due_date = OLD.due_date AND open_count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER payments_summary_update
+        AFTER UPDATE OF loan_id, amount_cents, due_date, paid ON payments
+        BEGIN
+            UPDATE loan_summary SET
+                paid_cents = paid_cents - CASE WHEN OLD.paid THEN OLD.amount_cents ELSE 0 END,
+                remaining_cents = remaining_cents - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount_cents END,
+                paid_count = paid_count - (OLD.paid != 0),
+                open_count = open_count - (OLD.paid = 0)
+            WHERE loan_id = OLD.loan_id;
+            UPDATE loan_summary SET
+                paid_cents = paid_cents + CASE WHEN NEW.paid THEN NEW.amount_cents ELSE 0 END,
+                remaining_cents = remaining_cents + CASE WHEN NEW.paid THEN 0 ELSE NEW.amount_cents END,
+                paid_count = paid_count + (NEW.paid != 0),
+                open_count = open_count + (NEW.paid = 0)
+            WHERE loan_id = NEW.loan_id;
+            UPDATE portfolio_summary SET
+                paid_cents = paid_cents
+                    - CASE WHEN OLD.paid THEN OLD.amount_cents ELSE 0 END
+                    + CASE WHEN NEW.paid THEN NEW.amount_cents ELSE 0 END,
+                outstanding_cents = outstanding_cents
+                    - CASE WHEN OLD.paid THEN 0 ELSE OLD.amount_cents END
+                    + CASE WHEN NEW.paid THEN 0 ELSE NEW.amount_cents END
+            WHERE id = 1;
+            UPDATE receivables_daily SET
+                open_cents = open_cents - OLD.amount_cents,
+                open_count = open_count - 1
+            WHERE due_date = OLD.due_date AND NOT OLD.paid;
+            DELETE FROM receivables_daily WHERE due_date = OLD.due_date AND open_count <= 0;
+            INSERT INTO receivables_daily (due_date, open_cents, open_count)
+            SELECT NEW.due_date, NEW.amount_cents, 1 WHERE NOT NEW.paid
+            ON CONFLICT (due_date) DO UPDATE SET
+                open_cents = open_cents + excluded.open_cents,
+                open_count = open_count + 1;
+        END
+        ''',
+    ),
+    # 9: busca de clientes (FTS5) e próximo vencimento em aberto por empréstimo,
+    # usados pelos filtros da lista de empréstimos
+    (
+        '''
+        CREATE VIRTUAL TABLE loans_fts USING fts5(
+            client_name,
+            content='loans', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        ''',
+        "INSERT INTO loans_fts (loans_fts) VALUES ('rebuild')",
+        '''
+        CREATE TRIGGER loans_fts_insert AFTER INSERT ON loans
+        BEGIN
+            INSERT INTO loans_fts (rowid, client_name) VALUES (NEW.id, NEW.client_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER loans_fts_delete AFTER DELETE ON loans
+        BEGIN
+            INSERT INTO loans_fts (loans_fts, rowid, client_name) VALUES ('delete', OLD.id, OLD.client_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER loans_fts_update AFTER UPDATE OF client_name ON loans
+        BEGIN
+            INSERT INTO loans_fts (loans_fts, rowid, client_name) VALUES ('delete', OLD.id, OLD.client_name);
+            INSERT INTO loans_fts (rowid, client_name) VALUES (NEW.id, NEW.client_name);
+        END
+        ''',
+        'ALTER TABLE loan_summary ADD COLUMN next_due_date TEXT',
+        '''
+        UPDATE loan_summary SET next_due_date = (
+            SELECT MIN(due_date) FROM payments p WHERE p.loan_id = loan_summary.loan_id AND NOT p.paid
+        )
+        ''',
+        'CREATE INDEX idx_loan_summary_next_due ON loan_summary (next_due_date)',
+        'CREATE INDEX idx_loans_start_date ON loans (start_date)',
+        # Uma parcela nova em aberto só pode antecipar o vencimento
+        '''
+        CREATE TRIGGER payments_next_due_insert AFTER INSERT ON payments
+        WHEN NOT NEW.paid
+        BEGIN
+            UPDATE loan_summary SET next_due_date = NEW.due_date
+            WHERE loan_id = NEW.loan_id
+              AND (next_due_date IS NULL OR next_due_date > NEW.due_date);
+        END
+        ''',
+        # Nos demais casos o mínimo é recalculado pelas parcelas do empréstimo (idx_payments_loan)
+        '''
+        CREATE TRIGGER payments_next_due_delete AFTER DELETE ON payments
+        WHEN NOT OLD.paid
+        BEGIN
+            UPDATE loan_summary SET next_due_date = (
+                SELECT MIN(due_date) FROM payments WHERE loan_id = OLD.loan_id AND NOT paid
+            )
+            WHERE loan_id = OLD.loan_id AND next_due_date = OLD.due_date;
+        END
+        ''',
+        '''
+        CREATE TRIGGER payments_next_due_update AFTER UPDATE OF loan_id, due_date, paid ON payments
+        BEGIN
+            UPDATE loan_summary SET next_due_date = (
+                SELECT MIN(due_date) FROM payments WHERE loan_id = loan_summary.loan_id AND NOT paid
+            )
+            WHERE loan_id IN (OLD.loan_id, NEW.loan_id);
+        END
+        ''',
+    ),
+    # 10: multa e mora das parcelas em atraso, calculadas pelo job late_fees
+    (
+        '''
+        CREATE TABLE late_charges
+        (payment_id INTEGER PRIMARY KEY,
+         loan_id INTEGER NOT NULL,
+         due_date TEXT NOT NULL,
+         amount_cents INTEGER NOT NULL,
+         fine_cents INTEGER NOT NULL,
+         mora_daily_rate REAL NOT NULL,
+         processed_on TEXT NOT NULL)
+        ''',
+        'CREATE INDEX idx_late_charges_loan ON late_charges (loan_id)',
+        # Parcelas já vencidas na última execução que mudaram depois dela
+        'CREATE TABLE late_charges_pending (payment_id INTEGER PRIMARY KEY)',
+        '''
+        CREATE TRIGGER payments_late_insert AFTER INSERT ON payments
+        WHEN NOT NEW.paid AND NEW.due_date < (SELECT last_run_date FROM job_runs WHERE job = 'late_fees')
+        BEGIN
+            INSERT OR IGNORE INTO late_charges_pending (payment_id) VALUES (NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER payments_late_update AFTER UPDATE OF paid, amount_cents, due_date ON payments
+        WHEN MIN(OLD.due_date, NEW.due_date) < (SELECT last_run_date FROM job_runs WHERE job = 'late_fees')
+        BEGIN
+            INSERT OR IGNORE INTO late_charges_pending (payment_id) VALUES (NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER payments_late_delete AFTER DELETE ON payments
+        BEGIN
+            DELETE FROM late_charges WHERE payment_id = OLD.id;
+            DELETE FROM late_charges_pending WHERE payment_id = OLD.id;
+        END
+        ''',
+    ),
+    # 11: livro de pagamentos (somente inclusão) e fotografias do total pago por empréstimo.
+    # payments.paid_cents e payments.paid passam a ser derivados dos eventos.
+    (
+        '''
+        CREATE TABLE payment_events
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         loan_id INTEGER NOT NULL,
+         payment_id INTEGER,
+         kind TEXT NOT NULL,
+         amount_cents INTEGER NOT NULL,
+         created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)
+        ''',
+        'CREATE INDEX idx_payment_events_loan ON payment_events (loan_id, id, amount_cents)',
+        '''
+        CREATE TABLE loan_balance_snapshots
+        (loan_id INTEGER NOT NULL,
+         event_id INTEGER NOT NULL,
+         paid_cents INTEGER NOT NULL,
+         events INTEGER NOT NULL,
+         PRIMARY KEY (loan_id, event_id))
+        ''',
+        'ALTER TABLE payments ADD COLUMN paid_cents INTEGER NOT NULL DEFAULT 0',
+        'UPDATE payments SET paid_cents = amount_cents WHERE paid',
+        'DROP INDEX idx_payments_loan',
+        '''
+        CREATE INDEX idx_payments_loan
+        ON payments (loan_id, installment_number, amount_cents, due_date, paid, paid_cents)
+        ''',
+        # Histórico: um evento por parcela já paga e uma fotografia por empréstimo
+        '''
+        INSERT INTO payment_events (loan_id, payment_id, kind, amount_cents)
+        SELECT loan_id, id, 'payment', paid_cents FROM payments WHERE paid_cents > 0 ORDER BY id
+        ''',
+        '''
+        INSERT INTO loan_balance_snapshots (loan_id, event_id, paid_cents, events)
+        SELECT loan_id, MAX(id), SUM(amount_cents), COUNT(*) FROM payment_events GROUP BY loan_id
+        ''',
+        '''
+        CREATE TRIGGER payment_events_no_update BEFORE UPDATE ON payment_events
+        BEGIN
+            SELECT RAISE(ABORT, 'payment_events é somente inclusão');
+        END
+        ''',
+        # Eventos só saem junto com o empréstimo (exclusão ou arquivamento)
+        '''
+        CREATE TRIGGER payment_events_no_delete BEFORE DELETE ON payment_events
+        WHEN EXISTS (SELECT 1 FROM loans WHERE id = OLD.loan_id)
+        BEGIN
+            SELECT RAISE(ABORT, 'payment_events é somente inclusão');
+        END
+        ''',
+        '''
+        CREATE TRIGGER payment_events_apply AFTER INSERT ON payment_events
+        WHEN NEW.payment_id IS NOT NULL
+        BEGIN
+            UPDATE payments SET
+                paid_cents = paid_cents + NEW.amount_cents,
+                paid = paid_cents + NEW.amount_cents >= amount_cents
+            WHERE id = NEW.payment_id;
+        END
+        ''',
+        # Nova fotografia a cada 32 eventos do empréstimo, para a cauda continuar curta
+        '''
+        CREATE TRIGGER payment_events_snapshot AFTER INSERT ON payment_events
+        BEGIN
+            INSERT INTO loan_balance_snapshots (loan_id, event_id, paid_cents, events)
+            SELECT NEW.loan_id, NEW.id,
+                   COALESCE(s.paid_cents, 0) + tail.paid_cents, COALESCE(s.events, 0) + tail.events
+            FROM (SELECT COUNT(*) AS events, SUM(amount_cents) AS paid_cents
+                  FROM payment_events
+                  WHERE loan_id = NEW.loan_id
+                    AND id > COALESCE((SELECT MAX(event_id) FROM loan_balance_snapshots
+                                       WHERE loan_id = NEW.loan_id), 0)) tail
+            LEFT JOIN loan_balance_snapshots s
+                ON s.loan_id = NEW.loan_id
+               AND s.event_id = (SELECT MAX(event_id) FROM loan_balance_snapshots WHERE loan_id = NEW.loan_id)
+            WHERE tail.events >= 32;
+        END
+        ''',
+        # Parcela re-amortizada: o status acompanha o novo valor
+        '''
+        CREATE TRIGGER payments_paid_sync AFTER UPDATE OF amount_cents ON payments
+        WHEN (NEW.paid_cents >= NEW.amount_cents) != NEW.paid
+        BEGIN
+            UPDATE payments SET paid = NEW.paid_cents >= NEW.amount_cents WHERE id = NEW.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER loans_events_delete AFTER DELETE ON loans
+        BEGIN
+            DELETE FROM payment_events WHERE loan_id = OLD.id;
+            DELETE FROM loan_balance_snapshots WHERE loan_id = OLD.id;
+        END
+        ''',
+    ),
+    # 12: multa e mora de parcelas pagas em atraso ficam gravadas, congeladas na
+    # data do pagamento (settled_on), em vez de serem excluídas pelo job
+    (
+        'ALTER TABLE late_charges ADD COLUMN settled_on TEXT',
+        # Pagas antes desta versão: a data exata não é conhecida; processed_on é a
+        # última execução em que ainda estavam em aberto
+        '''
+        UPDATE late_charges SET settled_on = processed_on
+        WHERE payment_id IN (SELECT id FROM payments WHERE paid)
+        ''',
+        '''
+        CREATE TRIGGER payments_late_settle AFTER UPDATE OF paid ON payments
+        WHEN NEW.paid != OLD.paid
+        BEGIN
+            UPDATE late_charges
+            SET settled_on = CASE WHEN NEW.paid THEN date('now', 'localtime') END
+            WHERE payment_id = NEW.id;
+        END
+        ''',
+    ),
+    # 13: multa e mora sobre o valor em aberto da parcela (amount_cents - paid_cents).
+    # late_charges.amount_cents passa a ser essa base; um pagamento parcial acumula a
+    # mora até o dia em mora_cents e a base menor vale a partir de mora_since
+    (
+        'ALTER TABLE late_charges ADD COLUMN mora_cents INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE late_charges ADD COLUMN mora_since TEXT',
+        # payments_late_update disparava com qualquer UPDATE de paid, inclusive o de um
+        # pagamento parcial (payment_events_apply), e o job recalculava a linha do zero
+        'DROP TRIGGER payments_late_update',
+        '''
+        CREATE TRIGGER payments_late_update AFTER UPDATE OF paid, amount_cents, due_date ON payments
+        WHEN (NEW.paid != OLD.paid OR NEW.amount_cents != OLD.amount_cents OR NEW.due_date != OLD.due_date)
+            AND MIN(OLD.due_date, NEW.due_date) < (SELECT last_run_date FROM job_runs WHERE job = 'late_fees')
+        BEGIN
+            INSERT OR IGNORE INTO late_charges_pending (payment_id) VALUES (NEW.id);
+        END
+        ''',
+        # As linhas em aberto são recalculadas na próxima execução do job
+        '''
+        INSERT OR IGNORE INTO late_charges_pending (payment_id)
+        SELECT payment_id FROM late_charges WHERE settled_on IS NULL
+        ''',
+        '''
+        CREATE TRIGGER payments_late_partial AFTER UPDATE OF paid_cents ON payments
+        WHEN NEW.paid_cents != OLD.paid_cents
+        BEGIN
+            UPDATE late_charges SET
+                mora_cents = mora_cents + CAST(ROUND(amount_cents * mora_daily_rate
+                    * MAX(julianday(date('now', 'localtime')) - julianday(COALESCE(mora_since, due_date)), 0))
+                    AS INTEGER),
+                mora_since = date('now', 'localtime'),
+                amount_cents = MAX(NEW.amount_cents - NEW.paid_cents, 0)
+            WHERE payment_id = NEW.id AND settled_on IS NULL;
+        END
+        ''',
+    ),
+    # 14: payments_paid_sync alterava paid dentro do UPDATE de amount_cents, e o
+    # payments_summary_update do UPDATE externo, com o paid antigo, desfazia o do
+    # aninhado nos resumos. reamortize_loan grava paid no mesmo UPDATE.
+    (
+        'DROP TRIGGER payments_paid_sync',
+        # Resumos já afetados são recalculados a partir das parcelas
+        'DELETE FROM loan_summary',
+        '''
+        INSERT INTO loan_summary (loan_id, paid_cents, remaining_cents, paid_count, open_count)
+        SELECT l.id,
+               COALESCE(SUM(CASE WHEN p.paid THEN p.amount_cents END), 0),
+               COALESCE(SUM(CASE WHEN NOT p.paid THEN p.amount_cents END), 0),
+               COUNT(CASE WHEN p.paid THEN 1 END),
+               COUNT(CASE WHEN NOT p.paid THEN 1 END)
+        FROM loans l LEFT JOIN payments p ON p.loan_id = l.id
+        GROUP BY l.id
+        ''',
+        '''
+        UPDATE portfolio_summary SET
+            paid_cents = (SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE paid),
+            outstanding_cents = (SELECT COALESCE(SUM(amount_cents), 0) FROM payments WHERE NOT paid)
+        WHERE id = 1
+        ''',
+        'DELETE FROM receivables_daily',
+        '''
+        INSERT INTO receivables_daily (due_date, open_cents, open_count)
+        SELECT due_date, SUM(amount_cents), COUNT(*) FROM payments WHERE NOT paid GROUP BY due_date
+        ''',
+    ),
+]
+
+# due_date é gravado como 'YYYY-MM-DD', então a comparação direta usa o índice
+DUE_PAYMENTS_SQL = '''
+    SELECT p.id, p.loan_id, p.installment_number, p.amount_cents, p.due_date, p.paid,
+           l.client_name, l.installments
+    FROM payments p
+    JOIN loans l ON p.loan_id = l.id
+    WHERE p.paid = 0 AND p.due_date = ?
+'''
+
+LOAN_PAYMENTS_SQL = '''
+    SELECT id, loan_id, installment_number, amount_cents, due_date, paid, paid_cents
+    FROM payments
+    WHERE loan_id = ?
+    ORDER BY installment_number
+'''
+
+# Evento que leva uma parcela ao estado :paid (None alterna); nenhum se ela já está nele
+RECORD_INSTALLMENT_SQL = '''
+    INSERT INTO payment_events (loan_id, payment_id, kind, amount_cents)
+    SELECT loan_id, id,
+           CASE WHEN target THEN 'payment' ELSE 'reversal' END,
+           CASE WHEN target THEN amount_cents - paid_cents ELSE -paid_cents END
+    FROM (SELECT loan_id, id, amount_cents, paid_cents, COALESCE(:paid, NOT paid) AS target
+          FROM payments WHERE id = :payment_id AND loan_id = :loan_id)
+    WHERE CASE WHEN target THEN paid_cents < amount_cents ELSE paid_cents > 0 END
+'''
+
+PAY_DUE_UNTIL_SQL = '''
+    INSERT INTO payment_events (loan_id, payment_id, kind, amount_cents)
+    SELECT loan_id, id, 'payment', amount_cents - paid_cents
+    FROM payments
+    WHERE loan_id = ? AND paid_cents < amount_cents AND due_date <= ?
+    ORDER BY installment_number
+'''
+
+# Distribui :amount_cents pelas parcelas em aberto, da mais antiga para a mais nova
+ALLOCATE_PAYMENT_SQL = '''
+    INSERT INTO payment_events (loan_id, payment_id, kind, amount_cents)
+    SELECT loan_id, id, 'payment', MIN(open_cents, :amount_cents - (running - open_cents))
+    FROM (
+        SELECT loan_id, id, amount_cents - paid_cents AS open_cents,
+               SUM(amount_cents - paid_cents) OVER (ORDER BY installment_number, id) AS running
+        FROM payments
+        WHERE loan_id = :loan_id AND paid_cents < amount_cents
+    )
+    WHERE running - open_cents < :amount_cents
+    ORDER BY running
+    RETURNING amount_cents
+'''
+
+LOAN_PAID_SQL = '''
+    SELECT COALESCE(s.paid_cents, 0) + COALESCE(
+        (SELECT SUM(e.amount_cents) FROM payment_events e
+         WHERE e.loan_id = :loan_id AND e.id > COALESCE(s.event_id, 0)), 0)
+    FROM (SELECT 1)
+    LEFT JOIN loan_balance_snapshots s
+        ON s.loan_id = :loan_id
+       AND s.event_id = (SELECT MAX(event_id) FROM loan_balance_snapshots WHERE loan_id = :loan_id)
+'''
+
+LOAN_EVENTS_SQL = '''
+    SELECT e.id, e.payment_id, p.installment_number, e.kind, e.amount_cents, e.created_at
+    FROM payment_events e
+    LEFT JOIN payments p ON p.id = e.payment_id
+    WHERE e.loan_id = ?
+    ORDER BY e.id
+'''
+
+COUNT_LOANS_SQL = 'SELECT COUNT(*) FROM loans'
+
+LOAN_SQL = '''
+    SELECT id, client_name, amount_cents, interest_rate, installments, start_date
+    FROM loans
+    WHERE id = ?
+'''
+
+# Uma página de empréstimos com total pago e restante lidos de loan_summary
+LOANS_PAGE_SQL = '''
+    SELECT l.id, l.client_name, l.amount_cents, l.interest_rate, l.installments, l.start_date,
+           COALESCE(s.paid_cents, 0) AS paid_cents,
+           COALESCE(s.remaining_cents, 0) AS remaining_cents
+    FROM loans l
+    LEFT JOIN loan_summary s ON s.loan_id = l.id
+    ORDER BY l.id
+    LIMIT ? OFFSET ?
+'''
+
+# Filtros da lista de empréstimos; {where} vem de loan_filters
+FILTERED_COUNT_SQL = '''
+    SELECT COUNT(*)
+    FROM loans l
+    LEFT JOIN loan_summary s ON s.loan_id = l.id
+    WHERE {where}
+'''
+
+FILTERED_LOANS_PAGE_SQL = '''
+    SELECT l.id, l.client_name, l.amount_cents, l.interest_rate, l.installments, l.start_date,
+           COALESCE(s.paid_cents, 0) AS paid_cents,
+           COALESCE(s.remaining_cents, 0) AS remaining_cents
+    FROM loans l
+    LEFT JOIN loan_summary s ON s.loan_id = l.id
+    WHERE {where}
+    ORDER BY l.id
+    LIMIT :limit OFFSET :offset
+'''
+
+# Situações aceitas por loan_filters
+LOAN_STATUSES = ('active', 'paid_off', 'overdue')
+
+PORTFOLIO_SUMMARY_SQL = '''
+    SELECT loan_count, principal_cents, paid_cents, outstanding_cents
+    FROM portfolio_summary
+    WHERE id = 1
+'''
+
+OVERDUE_SQL = '''
+    SELECT COALESCE(SUM(open_cents), 0), COALESCE(SUM(open_count), 0)
+    FROM receivables_daily
+    WHERE due_date < ?
+'''
+
+# Multa e mora das parcelas em atraso em uma data (dias corridos de atraso) e os
+# encargos das parcelas pagas em atraso, com a mora contada até o pagamento.
+# A mora é a acumulada até mora_since mais a da base atual desde então.
+LATE_CHARGES_TOTALS_SQL = '''
+    SELECT COALESCE(SUM(fine_cents) FILTER (WHERE settled_on IS NULL), 0),
+           COALESCE(SUM(mora_cents) FILTER (WHERE settled_on IS NULL), 0),
+           COALESCE(SUM(fine_cents + mora_cents) FILTER (WHERE settled_on IS NOT NULL), 0)
+    FROM (SELECT fine_cents, settled_on,
+                 mora_cents + CAST(ROUND(amount_cents * mora_daily_rate
+                     * MAX(julianday(COALESCE(settled_on, :today)) - julianday(COALESCE(mora_since, due_date)), 0))
+                     AS INTEGER) AS mora_cents
+          FROM late_charges)
+'''
+
+RECEIVABLES_BY_MONTH_SQL = '''
+    SELECT substr(due_date, 1, 7) AS month, SUM(open_cents) AS amount_cents, SUM(open_count) AS installments
+    FROM receivables_daily
+    GROUP BY month
+    ORDER BY month
+'''
+
+# Escopos: 'portfolio' (lista e totais) e 'loan:<id>' (parcelas de um empréstimo)
+BUMP_GENERATION = '''
+    INSERT INTO cache_generation (scope, generation) VALUES (?, 1)
+    ON CONFLICT (scope) DO UPDATE SET generation = generation + 1
+'''
+
+GET_GENERATION = 'SELECT generation FROM cache_generation WHERE scope = ?'
+
+INSERT_LOAN_EDIT = '''
+    INSERT INTO loan_edits
+    (loan_id, old_amount_cents, new_amount_cents, old_rate, new_rate, from_installment,
+     balance_cents, payment_cents)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_LOAN = '''
+    INSERT INTO loans (client_name, amount_cents, interest_rate, installments, start_date)
+    VALUES (:client_name, :amount_cents, :interest_rate, :installments, :start_date)
+'''
+
+INSERT_PAYMENT = '''
+    INSERT INTO payments (loan_id, installment_number, amount_cents, due_date)
+    VALUES (:loan_id, :installment_number, :amount_cents, :due_date)
+'''
+
+
+class _Lease:
+    """
+    Conexão emprestada a uma thread; volta ao pool quando a thread termina
+    """
+    def __init__(self, manager, conn):
+        self.manager = manager
+        self.conn = conn
+
+    def __del__(self):
+        self.manager._release(self.conn)
+
+
+class ConnectionManager:
+    """
+    Pool de conexões SQLite com uma conexão por thread
+    path: caminho do banco
+    busy_timeout: tempo máximo (ms) esperando um lock antes de falhar
+    max_idle: conexões ociosas mantidas abertas para reaproveitamento
+    factory: classe das conexões (ex.: metrics.InstrumentedConnection)
+
+    As conexões usam journal WAL, para que leitores não bloqueiem o escritor,
+    e mantêm um cache de comandos preparados reaproveitado entre execuções.
+    """
+    def __init__(self, path=DB_PATH, busy_timeout=5000, max_idle=8, cached_statements=256,
+                 factory=sqlite3.Connection):
+        self.path = path
+        self.factory = factory
+        self.busy_timeout = busy_timeout
+        self.max_idle = max_idle
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # check_same_thread=False: a conexão pode ser reaproveitada por outra
+        # thread depois de devolvida ao pool, mas nunca por duas ao mesmo tempo
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.factory,
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def connection(self):
+        """
+        Retorna a conexão da thread atual, abrindo ou reaproveitando uma do pool
+        """
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            lease = _Lease(self, conn or self._open())
+            self._local.lease = lease
+        return lease.conn
+
+    def close(self):
+        """
+        Fecha as conexões ociosas do pool
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def migrate(conn):
+    """
+    Aplica as migrações pendentes, uma transação por versão
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+        return len(MIGRATIONS)
+    while True:
+        # BEGIN IMMEDIATE serializa migrações concorrentes de outros processos
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                return version
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def explain_query_plan(conn, sql, params=()):
+    """
+    Retorna as linhas de EXPLAIN QUERY PLAN de uma consulta
+    """
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def search_query(text):
+    """
+    Converte o texto digitado em uma consulta FTS5: todas as palavras, cada
+    uma como prefixo ("jo silv" encontra "João da Silva")
+    """
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def loan_filters(search=None, status=None, start_from=None, start_to=None, today=None):
+    """
+    Monta as consultas de contagem e de página da lista filtrada
+    search: nome do cliente (palavras ou prefixos), via loans_fts
+    status: 'active' (com parcelas em aberto), 'paid_off' (quitado) ou
+            'overdue' (parcela em aberto vencida antes de today)
+    start_from/start_to: intervalo da data de início ('YYYY-MM-DD')
+
+    Retorna (count_sql, page_sql, params); page_sql recebe ainda :limit e
+    :offset em params.
+    """
+    conditions = []
+    params = {}
+    query = search_query(search)
+    if query:
+        conditions.append('l.id IN (SELECT rowid FROM loans_fts WHERE loans_fts MATCH :search)')
+        params['search'] = query
+    if status == 'active':
+        conditions.append('s.open_count > 0')
+    elif status == 'paid_off':
+        conditions.append('COALESCE(s.open_count, 0) = 0')
+    elif status == 'overdue':
+        conditions.append('s.next_due_date < :today')
+        params['today'] = today or datetime.now().strftime('%Y-%m-%d')
+    elif status is not None:
+        raise ValueError(f"status inválido: {status!r}")
+    if start_from:
+        conditions.append('l.start_date >= :start_from')
+        params['start_from'] = str(start_from)
+    if start_to:
+        # start_date pode ter hora ('YYYY-MM-DD HH:MM:SS' nos registros antigos)
+        conditions.append('l.start_date < :start_to_next')
+        params['start_to_next'] = (datetime.strptime(str(start_to)[:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    if not conditions:
+        # Sem filtros a contagem não precisa do resumo por empréstimo
+        return COUNT_LOANS_SQL, FILTERED_LOANS_PAGE_SQL.format(where='1'), params
+    where = ' AND '.join(conditions)
+    return FILTERED_COUNT_SQL.format(where=where), FILTERED_LOANS_PAGE_SQL.format(where=where), params
+
+
+def bump_generation(conn, loan_ids=()):
+    """
+    Invalida os caches da carteira e dos empréstimos informados
+    Deve ser chamada dentro da transação de quem altera loans ou payments.
+    """
+    scopes = [('portfolio',)] + [(f'loan:{int(loan_id)}',) for loan_id in loan_ids]
+    conn.executemany(BUMP_GENERATION, scopes)
+
+
+def generation(conn, scope='portfolio'):
+    """
+    Geração atual de um escopo de cache
+    """
+    row = conn.execute(GET_GENERATION, (scope,)).fetchone()
+    return row[0] if row else 0
+
+
+def create_loans(conn, loans):
+    """
+    Cria vários empréstimos e todas as suas parcelas em uma única transação
+    loans: lista de dicionários com client_name, amount_cents (centavos),
+           interest_rate, installments e, opcionalmente, start_date (datetime)
+           ou schedule (tabela já calculada por loan_schedule, cuja data de
+           início é usada)
+
+    Retorna uma lista de tuplas (loan, payments) com as linhas gravadas,
+    ids incluídos, sem precisar consultar o banco novamente.
+    """
+    if not loans:
+        return []
+
+    # numpy (via amortization) só é carregado por quem grava empréstimos
+    import numpy as np
+
+    from .amortization import annual_to_monthly_rate, due_dates, price_schedule_cents
+
+    now = datetime.now()
+    start_dates = [
+        loan['schedule']['start_date'] if 'schedule' in loan
+        else (loan.get('start_date') or now).strftime('%Y-%m-%d')
+        for loan in loans
+    ]
+
+    # Parcelas e vencimentos dos empréstimos sem tabela pronta, calculados em lote
+    tables = [loan.get('schedule') for loan in loans]
+    pending = [i for i, table in enumerate(tables) if table is None]
+    if pending:
+        schedule = price_schedule_cents(
+            [loans[i]['amount_cents'] for i in pending],
+            annual_to_monthly_rate([loans[i]['interest_rate'] for i in pending]),
+            [loans[i]['installments'] for i in pending],
+        )
+        dates = due_dates([start_dates[i] for i in pending], schedule['installment'].shape[1])
+        for row, i in enumerate(pending):
+            n = int(schedule['installments'][row])
+            tables[i] = {'installment': schedule['installment'][row, :n], 'due_date': dates[row, :n]}
+
+    created = []
+    all_payments = []
+    with conn:
+        c = conn.cursor()
+        for loan, start_date, table in zip(loans, start_dates, tables):
+            loan_row = {
+                'client_name': loan['client_name'],
+                'amount_cents': int(loan['amount_cents']),
+                'interest_rate': loan['interest_rate'],
+                'installments': len(table['installment']),
+                'start_date': start_date,
+            }
+            c.execute(INSERT_LOAN, loan_row)
+            loan_row = {'id': c.lastrowid, **loan_row}
+
+            payments = [
+                {
+                    'loan_id': loan_row['id'],
+                    'installment_number': k,
+                    'amount_cents': amount_cents,
+                    'due_date': due_date,
+                    'paid': 0,
+                    'paid_cents': 0,
+                }
+                for k, (amount_cents, due_date) in enumerate(
+                    zip(table['installment'].tolist(), np.datetime_as_string(table['due_date']).tolist()), 1
+                )
+            ]
+            all_payments.extend(payments)
+            created.append((loan_row, payments))
+
+        # Todas as parcelas do lote em um único executemany
+        c.executemany(INSERT_PAYMENT, all_payments)
+        # Na mesma transação os ids do AUTOINCREMENT são consecutivos, na ordem de inserção
+        last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        for payment_id, payment in enumerate(all_payments, last_id - len(all_payments) + 1):
+            payment['id'] = payment_id
+        bump_generation(conn, [loan_row['id'] for loan_row, _ in created])
+
+    return created
+
+
+def toggle_payment(conn, payment_id, paid=None):
+    """
+    Marca uma parcela como paga (pelo valor em aberto) ou estorna o que foi pago
+    paid: estado desejado; None alterna o estado atual
+    O pagamento é um evento em payment_events, e não uma alteração de
+    payments.paid; com paid informado, repetir a operação não tem efeito.
+    Retorna o id do empréstimo da parcela (ou None se ela não existe).
+    """
+    with conn:
+        rows = conn.execute('SELECT loan_id FROM payments WHERE id = ?', (payment_id,)).fetchall()
+        loan_id = rows[0][0] if rows else None
+        if loan_id is not None:
+            conn.execute(RECORD_INSTALLMENT_SQL, {
+                'payment_id': payment_id, 'loan_id': loan_id, 'paid': None if paid is None else int(bool(paid)),
+            })
+            bump_generation(conn, [loan_id])
+    return loan_id
+
+
+def delete_payment(conn, payment_id):
+    """
+    Exclui uma parcela
+    Parcelas com pagamento registrado (paid_cents > 0) não são excluídas:
+    os eventos continuariam no total pago do empréstimo. O pagamento deve
+    ser estornado antes (toggle_payment), o que fica registrado no livro.
+    Retorna o id do empréstimo da parcela (ou None se ela não existe).
+    """
+    with conn:
+        rows = conn.execute(
+            'DELETE FROM payments WHERE id = ? AND paid_cents = 0 RETURNING loan_id', (payment_id,)
+        ).fetchall()
+        loan_id = rows[0][0] if rows else None
+        if loan_id is not None:
+            bump_generation(conn, [loan_id])
+        elif conn.execute('SELECT 1 FROM payments WHERE id = ?', (payment_id,)).fetchone():
+            raise ValueError("parcela com pagamento registrado; estorne o pagamento antes de excluí-la")
+    return loan_id
+
+
+def delete_loan(conn, loan_id):
+    """
+    Exclui um empréstimo com as parcelas e o histórico de alterações
+    Empréstimos com eventos no livro de pagamentos não são excluídos, para
+    não apagar o histórico; quitados saem da carteira pelo arquivamento
+    (archive_settled_loans), que copia os eventos.
+    Retorna True se o empréstimo foi excluído.
+    """
+    with conn:
+        if conn.execute('SELECT 1 FROM payment_events WHERE loan_id = ? LIMIT 1', (loan_id,)).fetchone():
+            raise ValueError("empréstimo com pagamentos registrados não pode ser excluído")
+        conn.execute('DELETE FROM payments WHERE loan_id = ?', (loan_id,))
+        conn.execute('DELETE FROM loan_edits WHERE loan_id = ?', (loan_id,))
+        deleted = conn.execute('DELETE FROM loans WHERE id = ?', (loan_id,)).rowcount > 0
+        if deleted:
+            bump_generation(conn, [loan_id])
+    return deleted
+
+
+def set_payments_paid(conn, loan_id, changes):
+    """
+    Grava de uma vez o status de várias parcelas de um empréstimo
+    changes: pares (payment_id, paid); parcelas de outros empréstimos são ignoradas
+    Um único INSERT de eventos (executemany) em uma transação; parcelas que
+    já estão no estado pedido não geram evento. Retorna o número de
+    parcelas alteradas.
+    """
+    changes = [
+        {'payment_id': payment_id, 'loan_id': loan_id, 'paid': int(bool(paid))}
+        for payment_id, paid in changes
+    ]
+    if not changes:
+        return 0
+    with conn:
+        cursor = conn.executemany(RECORD_INSTALLMENT_SQL, changes)
+        if cursor.rowcount:
+            bump_generation(conn, [loan_id])
+    return cursor.rowcount
+
+
+def pay_due_until(conn, loan_id, date):
+    """
+    Paga as parcelas em aberto de um empréstimo com vencimento até date ('YYYY-MM-DD')
+    Retorna o número de parcelas pagas.
+    """
+    with conn:
+        cursor = conn.execute(PAY_DUE_UNTIL_SQL, (loan_id, str(date)[:10]))
+        if cursor.rowcount:
+            bump_generation(conn, [loan_id])
+    return cursor.rowcount
+
+
+def record_loan_payment(conn, loan_id, amount_cents):
+    """
+    Registra um pagamento parcial ou adiantado de um empréstimo
+    O valor quita as parcelas em aberto em ordem, e a última parcela
+    alcançada pode ficar paga em parte; o que exceder o saldo não é lançado.
+    Retorna o valor lançado em centavos.
+    """
+    if amount_cents <= 0:
+        return 0
+    with conn:
+        rows = conn.execute(
+            ALLOCATE_PAYMENT_SQL, {'loan_id': loan_id, 'amount_cents': int(amount_cents)}
+        ).fetchall()
+        if rows:
+            bump_generation(conn, [loan_id])
+    return sum(amount for amount, in rows)
+
+
+def loan_paid_cents(conn, loan_id):
+    """
+    Total pago de um empréstimo pelo livro de pagamentos: a última fotografia
+    mais os eventos posteriores a ela (no máximo algumas dezenas)
+    """
+    return conn.execute(LOAN_PAID_SQL, {'loan_id': loan_id}).fetchone()[0]
+
+
+def reamortize_loan(conn, loan_id, new_amount_cents, new_rate):
+    """
+    Altera valor (centavos) e taxa de um empréstimo recalculando só as parcelas em aberto
+    Tudo o que já foi pago (paid_cents de cada parcela, inclusive as pagas em
+    parte) abate o saldo devedor na data da parcela; o saldo após a última
+    parcela com pagamento é re-amortizado nas parcelas sem pagamento, gravadas
+    com um único executemany. Uma parcela paga em parte fica quitada pelo que
+    foi pago, ou recebe o saldo se não há parcelas depois dela.
+    A alteração fica registrada em loan_edits com o saldo e a nova parcela.
+    Se os pagamentos cobrem exatamente o novo valor, as parcelas restantes são
+    zeradas (e ficam quitadas).
+    Retorna o valor da nova parcela em centavos, ou 0 se o saldo foi quitado.
+    Levanta ValueError, sem alterar o empréstimo, se não há parcelas em
+    aberto, se os pagamentos excedem o novo valor ou se o saldo não cobre ao
+    menos 1 centavo por parcela.
+    """
+    from .amortization import annual_to_monthly_rate, reamortize
+    from .money import format_brl
+
+    with conn:
+        old_amount_cents, old_rate = conn.execute(
+            'SELECT amount_cents, interest_rate FROM loans WHERE id = ?', (loan_id,)
+        ).fetchone()
+
+        rows = conn.execute(LOAN_PAYMENTS_SQL, (loan_id,)).fetchall()
+        credits = [(number, paid_cents) for _, _, number, _, _, _, paid_cents in rows if paid_cents > 0]
+        partial = [(payment_id, number, paid_cents)
+                   for payment_id, _, number, _, _, is_paid, paid_cents in rows if not is_paid and paid_cents > 0]
+        open_ids = [payment_id for payment_id, _, _, _, _, is_paid, paid_cents in rows
+                    if not is_paid and paid_cents == 0]
+        last_credit = max((number for number, _ in credits), default=0)
+        if not open_ids and not (partial and partial[-1][1] == last_credit):
+            raise ValueError("o empréstimo não tem parcelas em aberto")
+
+        balance_cents, schedule = reamortize(
+            new_amount_cents,
+            float(annual_to_monthly_rate(new_rate)),
+            [number for number, _ in credits],
+            [paid_cents for _, paid_cents in credits],
+            len(open_ids),
+        )
+        if balance_cents < 0:
+            raise ValueError(f"os pagamentos registrados excedem o novo valor em {format_brl(-balance_cents)}")
+
+        if open_ids:
+            # Parcelas pagas em parte ficam quitadas pelo que foi pago
+            updates = [(paid_cents, payment_id) for payment_id, _, paid_cents in partial]
+            from_installment = last_credit + 1
+            if balance_cents == 0:
+                # Saldo já quitado pelos pagamentos
+                amounts = [0] * len(open_ids)
+                payment_cents = 0
+            else:
+                amounts = schedule['installment'][0, :len(open_ids)].tolist()
+                payment_cents = int(schedule['payment'][0])
+                if min(amounts) <= 0:
+                    raise ValueError(
+                        f"o saldo devedor de {format_brl(balance_cents)} não cobre {len(open_ids)} parcelas em aberto"
+                    )
+            updates.extend((int(amount), payment_id) for amount, payment_id in zip(amounts, open_ids))
+        else:
+            # Só resta a parcela paga em parte: ela recebe o saldo devedor
+            updates = [(paid_cents, payment_id) for payment_id, _, paid_cents in partial[:-1]]
+            payment_id, from_installment, paid_cents = partial[-1]
+            updates.append((paid_cents + balance_cents, payment_id))
+            payment_cents = paid_cents + balance_cents if balance_cents else 0
+
+        conn.execute(
+            'UPDATE loans SET amount_cents = ?, interest_rate = ? WHERE id = ?',
+            (int(new_amount_cents), new_rate, loan_id)
+        )
+        conn.executemany(
+            # paid no mesmo UPDATE: um trigger aninhado desencontraria os resumos
+            'UPDATE payments SET amount_cents = ?, paid = paid_cents >= ? WHERE id = ?',
+            [(amount, amount, payment_id) for amount, payment_id in updates]
+        )
+        conn.execute(INSERT_LOAN_EDIT, (
+            loan_id, old_amount_cents, int(new_amount_cents), old_rate, new_rate,
+            from_installment, balance_cents, payment_cents
+        ))
+
+        bump_generation(conn, [loan_id])
+    return payment_cents
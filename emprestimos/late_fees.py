@@ -0,0 +1,158 @@
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from .db import DB_PATH, bump_generation, migrate
+from .metrics import timed
+from .reminders import GET_WATERMARK, SET_WATERMARK, acquire_lock, release_lock
+
+
+JOB_NAME = 'late_fees'
+
+# Multa de 2% sobre a parcela e juros de mora de 1% ao mês, pro rata die
+FINE_RATE = 0.02
+MORA_DAILY_RATE = 0.01 / 30
+
+# Parcelas que venceram desde a última execução (ou todas, na primeira).
+# Em atraso = em aberto com vencimento anterior ao dia da execução; multa e
+# mora incidem sobre o valor ainda não pago da parcela.
+INSERT_NEWLY_OVERDUE = '''
+    INSERT OR REPLACE INTO late_charges
+        (payment_id, loan_id, due_date, amount_cents, fine_cents, mora_daily_rate, processed_on)
+    SELECT id, loan_id, due_date, amount_cents - paid_cents,
+           CAST(ROUND((amount_cents - paid_cents) * :fine_rate) AS INTEGER), :mora_rate, :today
+    FROM payments
+    WHERE paid = 0 AND due_date >= :since AND due_date < :today
+'''
+
+# Parcelas já processadas que mudaram (reabertas, re-amortizadas); as pagas
+# mantêm os encargos, congelados na data do pagamento (payments_late_settle)
+DELETE_PENDING_CHARGES = '''
+    DELETE FROM late_charges
+    WHERE payment_id IN (SELECT payment_id FROM late_charges_pending) AND settled_on IS NULL
+'''
+
+INSERT_PENDING_OVERDUE = '''
+    INSERT OR REPLACE INTO late_charges
+        (payment_id, loan_id, due_date, amount_cents, fine_cents, mora_daily_rate, processed_on)
+    SELECT p.id, p.loan_id, p.due_date, p.amount_cents - p.paid_cents,
+           CAST(ROUND((p.amount_cents - p.paid_cents) * :fine_rate) AS INTEGER), :mora_rate, :today
+    FROM late_charges_pending q
+    JOIN payments p ON p.id = q.payment_id
+    WHERE NOT p.paid AND p.due_date < :since
+'''
+
+CLEAR_PENDING = 'DELETE FROM late_charges_pending'
+
+
+@timed('job.late_fees')
+def process_late_fees(conn, today, job=JOB_NAME, fine_rate=FINE_RATE, mora_rate=MORA_DAILY_RATE):
+    """
+    Atualiza late_charges até `today` ('YYYY-MM-DD') em uma transação
+    Só são lidas as parcelas que venceram desde a marca d'água e as que
+    mudaram depois dela (late_charges_pending); a mora é calculada na
+    leitura (LATE_CHARGES_TOTALS_SQL), então as parcelas já em atraso não
+    precisam ser regravadas a cada dia. Os encargos de parcelas pagas
+    continuam gravados, com a mora contada até settled_on; pagamentos
+    parciais reduzem a base da mora a partir do dia do pagamento
+    (payments_late_partial).
+    Retorna o número de parcelas em atraso gravadas.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(GET_WATERMARK, (job,)).fetchone()
+        since = row[0] if row and row[0] else ''
+        if since >= today:
+            conn.rollback()
+            return 0
+        params = {'today': today, 'since': since, 'fine_rate': fine_rate, 'mora_rate': mora_rate}
+        conn.execute(DELETE_PENDING_CHARGES)
+        written = conn.execute(INSERT_PENDING_OVERDUE, params).rowcount
+        written += conn.execute(INSERT_NEWLY_OVERDUE, params).rowcount
+        conn.execute(CLEAR_PENDING)
+        conn.execute(SET_WATERMARK, (today, job))
+        bump_generation(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return written
+
+
+def run_late_fees(conn, today=None, owner=None, lock_ttl=600, job=JOB_NAME):
+    """
+    Executa o job com o lock de job_runs (um processo por vez)
+    Retorna o número de parcelas gravadas, ou None se outro processo tem o lock.
+    """
+    today = str(today or date.today())
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    if not acquire_lock(conn, job, owner, lock_ttl):
+        return None
+    try:
+        return process_late_fees(conn, today, job)
+    finally:
+        release_lock(conn, job, owner)
+
+
+class LateFeeScheduler(threading.Thread):
+    """
+    Agendador único por processo do cálculo diário de multa e mora
+    db: ConnectionManager
+    at_time: horário diário de execução ("HH:MM")
+    on_update: função chamada quando parcelas em atraso são gravadas
+    """
+    def __init__(self, db, at_time='00:05', on_update=None, lock_ttl=600, check_interval=60):
+        import schedule
+
+        super().__init__(name='late-fee-scheduler', daemon=True)
+        self.db = db
+        self.on_update = on_update
+        self.lock_ttl = lock_ttl
+        self.check_interval = check_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self.scheduler = schedule.Scheduler()
+        self.scheduler.every().day.at(at_time).do(self.run_once)
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        # Recupera o dia perdido enquanto o processo estava parado
+        self.run_once()
+        while not self._stopping.is_set():
+            self.scheduler.run_pending()
+            self._stopping.wait(self.check_interval)
+
+    def run_once(self, now=None):
+        now = now or datetime.now()
+        written = run_late_fees(self.db.connection(), now.date(), self.owner, self.lock_ttl)
+        if written and self.on_update:
+            self.on_update()
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcula multa e mora das parcelas em atraso (job diário)")
+    parser.add_argument('--db', default=DB_PATH, help="banco de dados (padrão: %(default)s)")
+    parser.add_argument('--date', default=None, help="data da execução, YYYY-MM-DD (padrão: hoje)")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        migrate(conn)
+        written = run_late_fees(conn, args.date and date.fromisoformat(args.date))
+    finally:
+        conn.close()
+    if written is None:
+        print("Job em execução em outro processo")
+        return 1
+    print(f"{written} parcelas em atraso atualizadas")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+import threading
+import time
+
+from .metrics import timed
+
+
+INSERT_OUTBOX = '''
+    INSERT INTO outbox (to_email, subject, body, attachment, attachment_name)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Reserva um lote de mensagens; a reserva expira após `lease` segundos, então
+# mensagens de um worker que caiu no meio do envio voltam para a fila
+CLAIM_OUTBOX = '''
+    UPDATE outbox
+    SET status = 'sending', next_attempt_at = :now + :lease
+    WHERE id IN (
+        SELECT id FROM outbox
+        WHERE status IN ('pending', 'sending') AND next_attempt_at <= :now
+        ORDER BY id
+        LIMIT :limit
+    )
+    RETURNING id, to_email, subject, body, attachment, attachment_name, attempts
+'''
+
+MARK_SENT = '''
+    UPDATE outbox
+    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, attachment = NULL, last_error = NULL
+    WHERE id = ?
+'''
+
+MARK_RETRY = '''
+    UPDATE outbox
+    SET status = CASE WHEN attempts + 1 >= :max_attempts THEN 'failed' ELSE 'pending' END,
+        attempts = attempts + 1,
+        next_attempt_at = :next_attempt_at,
+        last_error = :error
+    WHERE id = :id
+'''
+
+
+def build_message(from_email, to_email, subject, body, attachment=None, attachment_name=None):
+    """
+    Monta a mensagem HTML, com um PDF anexo opcional (bytes)
+    """
+    # smtplib e email.mime são importados no primeiro envio, não na importação
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Subject'] = subject
+
+    msg.attach(MIMEText(body, 'html'))
+
+    if attachment:
+        pdf = MIMEApplication(attachment, _subtype='pdf')
+        pdf.add_header('Content-Disposition', 'attachment', filename=attachment_name or 'anexo.pdf')
+        msg.attach(pdf)
+
+    return msg
+
+
+def enqueue_email(conn, to_email, subject, body, attachment=None, attachment_name=None):
+    """
+    Grava a mensagem na tabela outbox para envio pelo OutboxWorker
+    """
+    with conn:
+        c = conn.execute(INSERT_OUTBOX, (to_email, subject, body, attachment, attachment_name))
+    return c.lastrowid
+
+
+class OutboxWorker(threading.Thread):
+    """
+    Thread que esvazia a tabela outbox usando uma única sessão SMTP
+    db: ConnectionManager
+    settings: dicionário com host, port, user, password, from_email e
+              use_tls (STARTTLS; desligue para servidores locais como aiosmtpd)
+
+    Mensagens com falha são reenviadas com backoff exponencial até
+    max_attempts tentativas; depois ficam com status 'failed'.
+    """
+    def __init__(self, db, settings, batch_size=20, poll_interval=5.0, idle_timeout=60.0,
+                 max_attempts=8, base_delay=30.0, max_delay=3600.0, lease=300.0):
+        super().__init__(name='outbox-worker', daemon=True)
+        self.db = db
+        self.settings = settings
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self._server = None
+        self._last_used = 0.0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def wake(self):
+        """
+        Acorda o worker para enviar mensagens recém-enfileiradas
+        """
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                sent = self.drain()
+            except Exception:
+                sent = 0
+                self._disconnect()
+            if not sent:
+                if self._server and time.time() - self._last_used > self.idle_timeout:
+                    self._disconnect()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        self._disconnect()
+
+    def drain(self):
+        """
+        Envia lotes até a fila esvaziar; retorna quantas mensagens foram enviadas
+        """
+        total = 0
+        while not self._stopping.is_set():
+            batch = self._claim()
+            if not batch:
+                break
+            total += self._send_batch(batch)
+        return total
+
+    def _claim(self):
+        conn = self.db.connection()
+        with conn:
+            return conn.execute(CLAIM_OUTBOX, {
+                'now': time.time(), 'lease': self.lease, 'limit': self.batch_size,
+            }).fetchall()
+
+    def _send_batch(self, batch):
+        import smtplib
+
+        sent_ids = []
+        failures = []
+        for row in batch:
+            message_id, to_email, subject, body, attachment, attachment_name, attempts = row
+            msg = build_message(
+                self.settings['from_email'], to_email, subject, body, attachment, attachment_name
+            )
+            try:
+                self._deliver(msg)
+                self._last_used = time.time()
+                sent_ids.append((message_id,))
+            except (smtplib.SMTPException, OSError) as exc:
+                failures.append(self._retry(message_id, attempts, exc))
+                if not isinstance(exc, smtplib.SMTPResponseException):
+                    # Falha de conexão: reconecta na próxima mensagem
+                    self._disconnect()
+
+        conn = self.db.connection()
+        with conn:
+            conn.executemany(MARK_SENT, sent_ids)
+            conn.executemany(MARK_RETRY, failures)
+        return len(sent_ids)
+
+    def _retry(self, message_id, attempts, exc):
+        delay = min(self.base_delay * 2 ** attempts, self.max_delay)
+        return {
+            'id': message_id,
+            'max_attempts': self.max_attempts,
+            'next_attempt_at': time.time() + delay,
+            'error': f"{type(exc).__name__}: {exc}",
+        }
+
+    @timed('smtp.send')
+    def _deliver(self, msg):
+        import smtplib
+
+        try:
+            self._connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # A sessão persistente expirou no servidor: reconecta uma vez
+            self._disconnect()
+            self._connection().send_message(msg)
+
+    def _connection(self):
+        import smtplib
+
+        if self._server is None:
+            settings = self.settings
+            server = smtplib.SMTP(settings['host'], int(settings['port']), timeout=30)
+            if settings.get('use_tls', True):
+                server.starttls()
+            if settings.get('user') and settings.get('password'):
+                server.login(settings['user'], settings['password'])
+            self._server = server
+        return self._server
+
+    def _disconnect(self):
+        import smtplib
+
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
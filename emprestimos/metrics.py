@@ -0,0 +1,160 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+
+
+# Limites dos histogramas de latência, em segundos
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+
+
+class Histogram:
+    """
+    Contagem, soma, máximo e distribuição por faixas da latência de uma operação
+    """
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class Registry:
+    """
+    Métricas do processo (acumuladas) e da execução atual do script do
+    Streamlit (por thread, iniciadas com begin_rerun)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._local = threading.local()
+
+    def observe(self, operation, seconds):
+        with self._lock:
+            self._totals.setdefault(operation, Histogram()).observe(seconds)
+        rerun = getattr(self._local, 'rerun', None)
+        if rerun is not None:
+            rerun.setdefault(operation, Histogram()).observe(seconds)
+
+    def begin_rerun(self):
+        """
+        Começa a contar as operações da thread atual separadamente
+        """
+        self._local.rerun = {}
+
+    def rerun(self):
+        """
+        Histogramas das operações da execução atual (desde begin_rerun)
+        """
+        return dict(getattr(self._local, 'rerun', None) or {})
+
+    def totals(self):
+        with self._lock:
+            return {
+                operation: (h.count, h.total, list(h.buckets))
+                for operation, h in self._totals.items()
+            }
+
+    def prometheus(self, prefix='loans_app'):
+        """
+        Métricas acumuladas no formato de texto do Prometheus
+        """
+        name = f"{prefix}_operation_seconds"
+        lines = [
+            f"# HELP {name} Latência das operações instrumentadas do app.",
+            f"# TYPE {name} histogram",
+        ]
+        for operation, (count, total, buckets) in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{operation="{operation}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{operation="{operation}"}} {total:.6f}')
+            lines.append(f'{name}_count{{operation="{operation}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='loans_app'):
+        """
+        Grava as métricas em um arquivo de texto para o coletor do Prometheus
+        (node_exporter textfile); a troca é atômica para não expor arquivo parcial
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus(prefix))
+        os.replace(tmp, path)
+
+
+# Registro único do processo
+registry = Registry()
+
+
+def timed(operation):
+    """
+    Decorador que registra a latência de cada chamada da função
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registry.observe(operation, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _statement_kind(sql):
+    # Primeira palavra do comando: select, insert, update, delete, pragma...
+    words = sql.lstrip().split(None, 1)
+    return words[0].lower() if words else 'empty'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor que registra o tempo de execute/executemany por tipo de comando
+    O tempo inclui preparar e executar até a primeira linha; a leitura das
+    linhas restantes (fetch) não é medida.
+    """
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            registry.observe(f"sqlite.{_statement_kind(sql)}", time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            registry.observe(f"sqlite.{_statement_kind(sql)}_many", time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Conexão cujos comandos passam por InstrumentedCursor
+    Uso: sqlite3.connect(path, factory=InstrumentedConnection)
+    """
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute não passa por cursor(), então é redefinido aqui
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
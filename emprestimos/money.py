@@ -0,0 +1,42 @@
+# numpy é importado só nas funções que o usam: format_brl, usado pelos
+# templates e pelo PDF, não precisa dele
+
+
+# Tabela de tradução pré-compilada: 1,234.56 -> 1.234,56
+_BRL_SEPARATORS = str.maketrans(',.', '.,')
+
+
+def round_half_up(value):
+    """
+    Arredonda valores não negativos para o inteiro mais próximo (0,5 para cima)
+    """
+    import numpy as np
+    return np.floor(np.asarray(value, dtype=np.float64) + 0.5).astype(np.int64)
+
+
+def to_cents(value):
+    """
+    Converte valores em reais (float) para centavos inteiros (int64)
+    """
+    import numpy as np
+    value = np.asarray(value, dtype=np.float64)
+    # O arredondamento intermediário evita que 1.005 * 100 vire 100.4999...
+    cents = round_half_up(np.round(np.abs(value) * 100, 6)) * np.sign(value).astype(np.int64)
+    return int(cents) if cents.ndim == 0 else cents
+
+
+def from_cents(cents):
+    """
+    Converte centavos inteiros para reais (float), apenas para exibição e entrada
+    """
+    return int(cents) / 100
+
+
+def format_brl(cents, prefix='R$ '):
+    """
+    Formata centavos inteiros no padrão brasileiro: R$ 1.234,56
+    """
+    cents = int(cents)
+    sign = '-' if cents < 0 else ''
+    reais, centavos = divmod(abs(cents), 100)
+    return f"{sign}{prefix}{reais:,}".translate(_BRL_SEPARATORS) + f",{centavos:02d}"
@@ -0,0 +1,117 @@
+import functools
+from io import BytesIO
+
+from .metrics import timed
+from .money import format_brl
+
+
+COL_WIDTHS = [80, 120, 100, 100]
+
+
+@functools.cache
+def styles():
+    """
+    Estilos do PDF, criados uma única vez no primeiro uso
+    O reportlab só é importado aqui, para que importar o módulo seja barato.
+    Retorna (título, texto normal, tabela); os estilos de parágrafo são
+    cópias próprias para não alterar a folha de estilos compartilhada.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.platypus import TableStyle
+
+    sample_styles = getSampleStyleSheet()
+
+    title_style = ParagraphStyle(
+        'LoanTitle',
+        parent=sample_styles['Title'],
+        fontSize=18,
+        leading=22,
+        textColor=colors.HexColor('#2F4F4F'),
+    )
+
+    normal_style = ParagraphStyle(
+        'LoanNormal',
+        parent=sample_styles['Normal'],
+        fontSize=12,
+        leading=16,
+        spaceAfter=12,
+    )
+
+    table_style = TableStyle([
+        # Cabeçalho
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+
+        # Corpo
+        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f9f9f9')),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 11),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
+
+        # Linhas alternadas
+        ('BACKGROUND', (0, 2), (-1, -1), colors.HexColor('#ffffff')),
+        ('BACKGROUND', (0, 3), (-1, -1), colors.HexColor('#f2f2f2')),
+
+        # Grade
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+    ])
+
+    return title_style, normal_style, table_style
+
+
+def pdf_filename(loan_data):
+    return f"loan_{loan_data['id']}_{loan_data['client_name']}.pdf"
+
+
+@timed('create_pdf')
+def create_pdf(loan_data, payments_data):
+    """
+    Gera o PDF do empréstimo em memória e retorna os bytes
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, Spacer
+
+    title_style, normal_style, table_style = styles()
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = []
+
+    # Cabeçalho
+    elements.append(Paragraph(f"Detalhes do Empréstimo - {loan_data['client_name']}", title_style))
+    elements.append(Spacer(1, 12))  # Espaçamento
+
+    # Informações do empréstimo
+    elements.append(Paragraph(f"Valor do Empréstimo: {format_brl(loan_data['amount_cents'])}", normal_style))
+    elements.append(Paragraph(f"Taxa de Juros: {loan_data['interest_rate']}%", normal_style))
+    elements.append(Paragraph(f"Número de Parcelas: {loan_data['installments']}", normal_style))
+    elements.append(Spacer(1, 20))  # Espaçamento maior antes da tabela
+
+    # Dados da tabela
+    data = [['Parcela', 'Data de Vencimento', 'Valor', 'Status']]
+    for payment in payments_data:
+        data.append([
+            payment['installment_number'],
+            payment['due_date'],
+            format_brl(payment['amount_cents']),
+            'Pago' if payment['paid'] else 'Pendente'
+        ])
+
+    table = Table(data, colWidths=COL_WIDTHS)
+    table.setStyle(table_style)
+
+    elements.append(table)
+    elements.append(Spacer(1, 20))  # Espaçamento após a tabela
+
+    # Nota final
+    elements.append(Paragraph("Por favor, entre em contato conosco caso tenha dúvidas sobre seu empréstimo.", normal_style))
+
+    # Construção do PDF
+    doc.build(elements)
+    return buffer.getvalue()
@@ -0,0 +1,202 @@
+import functools
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from .db import DUE_PAYMENTS_SQL
+from .mailer import INSERT_OUTBOX
+from .money import format_brl
+
+
+JOB_NAME = 'due_reminders'
+
+ENSURE_JOB = 'INSERT OR IGNORE INTO job_runs (job) VALUES (?)'
+
+# Lock com prazo: só um processo executa o job por vez, e um processo que
+# morreu segurando o lock o perde quando locked_until expira
+ACQUIRE_LOCK = '''
+    UPDATE job_runs
+    SET locked_by = :owner, locked_until = :now + :ttl
+    WHERE job = :job AND (locked_until < :now OR locked_by = :owner)
+'''
+
+RELEASE_LOCK = '''
+    UPDATE job_runs SET locked_by = NULL, locked_until = 0
+    WHERE job = ? AND locked_by = ?
+'''
+
+GET_WATERMARK = 'SELECT last_run_date FROM job_runs WHERE job = ?'
+
+# Upsert: chamadas diretas, sem acquire_lock, ainda não têm a linha do job
+SET_WATERMARK = '''
+    INSERT INTO job_runs (last_run_date, job) VALUES (?, ?)
+    ON CONFLICT (job) DO UPDATE SET last_run_date = excluded.last_run_date
+'''
+
+MARK_REMINDED = '''
+    INSERT OR IGNORE INTO reminders_sent (payment_id, due_date) VALUES (?, ?)
+'''
+
+# Templates na raiz do projeto, compartilhados com o serviço web
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+@functools.cache
+def reminder_template():
+    """
+    Template do lembrete, compilado uma única vez no primeiro uso
+    """
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    templates = Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        autoescape=select_autoescape(['html']),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    templates.filters['brl'] = format_brl
+    return templates.get_template('email/payment_reminder.html')
+
+
+def render_reminders(payments, digest=True):
+    """
+    Renderiza os lembretes de um lote de parcelas (linhas de DUE_PAYMENTS_SQL)
+    digest: agrupa as parcelas do mesmo cliente e vencimento em um único e-mail
+
+    Retorna uma lista de tuplas (assunto, corpo).
+    """
+    groups = {}
+    for payment in payments:
+        key = (payment['client_name'], payment['due_date']) if digest else payment['id']
+        groups.setdefault(key, []).append(payment)
+
+    messages = []
+    for group in groups.values():
+        if len(group) == 1:
+            subject = f"Lembrete de Pagamento - Parcela {group[0]['installment_number']}"
+        else:
+            subject = f"Lembrete de Pagamento - {len(group)} Parcelas"
+        body = reminder_template().render(
+            client_name=group[0]['client_name'],
+            payments=group,
+            total_cents=sum(payment['amount_cents'] for payment in group),
+        )
+        messages.append((subject, body))
+    return messages
+
+
+def acquire_lock(conn, job, owner, ttl):
+    with conn:
+        conn.execute(ENSURE_JOB, (job,))
+        c = conn.execute(ACQUIRE_LOCK, {'job': job, 'owner': owner, 'now': time.time(), 'ttl': ttl})
+    return c.rowcount == 1
+
+
+def release_lock(conn, job, owner):
+    with conn:
+        conn.execute(RELEASE_LOCK, (job, owner))
+
+
+def pending_days(conn, job, through, max_catchup_days=30):
+    """
+    Dias ainda não processados pelo job, do dia seguinte à marca d'água até `through`
+    """
+    row = conn.execute(GET_WATERMARK, (job,)).fetchone()
+    if row is None or row[0] is None:
+        first = through
+    else:
+        first = date.fromisoformat(row[0]) + timedelta(days=1)
+    first = max(first, through - timedelta(days=max_catchup_days - 1))
+    return [first + timedelta(days=i) for i in range((through - first).days + 1)]
+
+
+def process_day(conn, day, to_email, job=JOB_NAME, digest=True):
+    """
+    Enfileira os lembretes das parcelas que vencem em `day` e avança a marca
+    d'água na mesma transação. Parcelas já lembradas são ignoradas.
+    Retorna o número de e-mails enfileirados.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        payments = [
+            payment for payment in c.execute(DUE_PAYMENTS_SQL, (day.isoformat(),)).fetchall()
+            if conn.execute(MARK_REMINDED, (payment['id'], payment['due_date'])).rowcount
+        ]
+        messages = render_reminders(payments, digest)
+        conn.executemany(INSERT_OUTBOX, [
+            (to_email, subject, body, None, None) for subject, body in messages
+        ])
+        queued = len(messages)
+        conn.execute(SET_WATERMARK, (day.isoformat(), job))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return queued
+
+
+class ReminderScheduler(threading.Thread):
+    """
+    Agendador único por processo dos lembretes de vencimento
+    db: ConnectionManager
+    to_email: destinatário dos lembretes
+    at_time: horário diário de envio ("HH:MM")
+    on_enqueue: função chamada quando novos lembretes entram na outbox
+    digest: um e-mail por cliente e dia em vez de um por parcela
+
+    A marca d'água em job_runs garante que dias perdidos (servidor parado)
+    sejam recuperados e que cada dia seja processado uma única vez, mesmo com
+    vários processos: só quem obtém o lock do job executa.
+    """
+    def __init__(self, db, to_email, at_time='08:00', on_enqueue=None, digest=True,
+                 lock_ttl=600, check_interval=60, job=JOB_NAME):
+        import schedule
+
+        super().__init__(name='reminder-scheduler', daemon=True)
+        self.db = db
+        self.to_email = to_email
+        self.at_time = datetime.strptime(at_time, '%H:%M').time()
+        self.on_enqueue = on_enqueue
+        self.digest = digest
+        self.lock_ttl = lock_ttl
+        self.check_interval = check_interval
+        self.job = job
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self.scheduler = schedule.Scheduler()
+        self.scheduler.every().day.at(at_time).do(self.run_once)
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        # Recupera os dias perdidos enquanto o processo estava parado
+        self.run_once()
+        while not self._stopping.is_set():
+            self.scheduler.run_pending()
+            self._stopping.wait(self.check_interval)
+
+    def run_once(self, now=None):
+        """
+        Processa todos os dias pendentes até hoje (ou até ontem, antes do
+        horário de envio). Retorna o número de lembretes enfileirados.
+        """
+        now = now or datetime.now()
+        through = now.date() if now.time() >= self.at_time else now.date() - timedelta(days=1)
+        conn = self.db.connection()
+        if not acquire_lock(conn, self.job, self.owner, self.lock_ttl):
+            return 0
+        queued = 0
+        try:
+            for day in pending_days(conn, self.job, through):
+                queued += process_day(conn, day, self.to_email, self.job, self.digest)
+        finally:
+            release_lock(conn, self.job, self.owner)
+        if queued and self.on_enqueue:
+            self.on_enqueue()
+        return queued
@@ -0,0 +1,144 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from emprestimos.archive import ARCHIVE_PATH
+from emprestimos.db import DB_PATH, MIGRATIONS
+
+
+# Colunas exportadas de cada tabela; datas viram date32 e paid vira booleano
+TABLES = {
+    'loans': (
+        'SELECT id, client_name, amount_cents, interest_rate, installments, substr(start_date, 1, 10) '
+        'FROM {schema}.loans WHERE id > ? ORDER BY id LIMIT ?',
+        pa.schema([
+            ('id', pa.int64()),
+            ('client_name', pa.string()),
+            ('amount_cents', pa.int64()),
+            ('interest_rate', pa.float64()),
+            ('installments', pa.int32()),
+            ('start_date', pa.date32()),
+            ('archived', pa.bool_()),
+        ]),
+    ),
+    'payments': (
+        'SELECT id, loan_id, installment_number, amount_cents, due_date, paid, paid_cents '
+        'FROM {schema}.payments WHERE id > ? ORDER BY id LIMIT ?',
+        pa.schema([
+            ('id', pa.int64()),
+            ('loan_id', pa.int64()),
+            ('installment_number', pa.int32()),
+            ('amount_cents', pa.int64()),
+            ('due_date', pa.date32()),
+            ('paid', pa.bool_()),
+            ('paid_cents', pa.int64()),
+            ('archived', pa.bool_()),
+        ]),
+    ),
+}
+
+FORMATS = ('parquet', 'arrow')
+
+
+def iter_record_batches(conn, table, schemas, batch_size=100_000):
+    """
+    Lê uma tabela em lotes pela chave primária, sem carregar tudo em memória
+    schemas: bancos a percorrer ('main' e, se anexado, 'archive')
+    Gera pyarrow.RecordBatch no esquema de TABLES.
+    """
+    sql, schema = TABLES[table]
+    for name in schemas:
+        last_id = 0
+        while True:
+            rows = conn.execute(sql.format(schema=name), (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            columns.append([name == 'archive'] * len(rows))
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(column).cast(field.type) for column, field in zip(columns, schema)],
+                schema=schema,
+            )
+            last_id = rows[-1][0]
+
+
+def export_analytics(output_dir, db_path=DB_PATH, archive_path=ARCHIVE_PATH, formats=FORMATS,
+                     batch_size=100_000):
+    """
+    Exporta loans e payments (incluindo o banco de arquivo, se existir) para
+    arquivos colunares em output_dir
+    formats: 'parquet' (compactado, zstd) e/ou 'arrow' (IPC sem compressão,
+             que pode ser aberto com pyarrow.memory_map sem cópia)
+
+    O banco é aberto somente leitura e os arquivos são gravados em um
+    temporário e renomeados no fim, então leitores nunca veem uma exportação
+    pela metade.
+    Retorna um dicionário {tabela: linhas exportadas}.
+    """
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    # Somente leitura: o banco não pode ser migrado aqui
+    if conn.execute('PRAGMA user_version').fetchone()[0] < len(MIGRATIONS):
+        conn.close()
+        raise ValueError(f"{db_path}: esquema desatualizado; abra o app ou rode as migrações antes de exportar")
+    os.makedirs(output_dir, exist_ok=True)
+    schemas = ['main']
+    if archive_path and os.path.exists(archive_path):
+        conn.execute('ATTACH DATABASE ? AS archive', (f"file:{os.path.abspath(archive_path)}?mode=ro",))
+        schemas.append('archive')
+
+    counts = {}
+    try:
+        for table, (_, schema) in TABLES.items():
+            paths = {fmt: os.path.join(output_dir, f"{table}.{fmt}") for fmt in formats}
+            writers = {}
+            if 'parquet' in paths:
+                writers['parquet'] = pq.ParquetWriter(f"{paths['parquet']}.tmp", schema, compression='zstd')
+            if 'arrow' in paths:
+                writers['arrow'] = pa.ipc.new_file(f"{paths['arrow']}.tmp", schema)
+            counts[table] = 0
+            try:
+                for batch in iter_record_batches(conn, table, schemas, batch_size):
+                    for writer in writers.values():
+                        writer.write_batch(batch)
+                    counts[table] += batch.num_rows
+            except Exception:
+                for fmt, writer in writers.items():
+                    writer.close()
+                    os.remove(f"{paths[fmt]}.tmp")
+                raise
+            for writer in writers.values():
+                writer.close()
+            for path in paths.values():
+                os.replace(f"{path}.tmp", path)
+    finally:
+        conn.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta empréstimos e parcelas para Parquet/Arrow")
+    parser.add_argument('output', help="pasta de saída")
+    parser.add_argument('--db', default=DB_PATH, help="caminho do banco (padrão: %(default)s)")
+    parser.add_argument('--archive', default=ARCHIVE_PATH, help="banco de arquivo (padrão: %(default)s)")
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=list(FORMATS),
+                        help="formatos gerados (padrão: todos)")
+    parser.add_argument('--batch-size', type=int, default=100_000, help="linhas por lote")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        counts = export_analytics(args.output, args.db, args.archive, args.format, args.batch_size)
+    except ValueError as exc:
+        parser.exit(1, f"erro: {exc}\n")
+    elapsed = time.perf_counter() - start
+    summary = ', '.join(f"{rows} {table}" for table, rows in counts.items())
+    print(f"{summary} exportados em {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
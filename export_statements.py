@@ -0,0 +1,120 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from emprestimos.db import DB_PATH
+from emprestimos.pdf_report import create_pdf, pdf_filename
+
+
+LOANS_BATCH_SQL = '''
+    SELECT id, client_name, amount_cents, interest_rate, installments, start_date
+    FROM loans
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+PAYMENTS_BATCH_SQL = '''
+    SELECT loan_id, installment_number, amount_cents, due_date, paid
+    FROM payments
+    WHERE loan_id BETWEEN ? AND ?
+    ORDER BY loan_id, installment_number
+'''
+
+
+def iter_statement_batches(conn, batch_size=16):
+    """
+    Percorre a carteira em lotes de empréstimos com suas parcelas, sem
+    carregar tudo em memória. Gera listas de tuplas (loan, payments).
+    """
+    conn.row_factory = sqlite3.Row
+    last_id = 0
+    while True:
+        loans = [dict(row) for row in conn.execute(LOANS_BATCH_SQL, (last_id, batch_size))]
+        if not loans:
+            return
+        payments = {loan['id']: [] for loan in loans}
+        for row in conn.execute(PAYMENTS_BATCH_SQL, (loans[0]['id'], loans[-1]['id'])):
+            payments[row['loan_id']].append(dict(row))
+        yield [(loan, payments[loan['id']]) for loan in loans]
+        last_id = loans[-1]['id']
+
+
+def render_batch(batch):
+    """
+    Executado nos processos do pool: gera os PDFs de um lote
+    """
+    return [
+        (pdf_filename(loan).replace('/', '_'), create_pdf(loan, payments))
+        for loan, payments in batch
+    ]
+
+
+def export_statements(output, db_path=DB_PATH, workers=None, batch_size=16, progress=None):
+    """
+    Gera os extratos de todos os empréstimos em paralelo e grava em um ZIP
+    output: caminho ou arquivo binário de saída
+    workers: número de processos (padrão: um por núcleo)
+    progress: função chamada com (concluídos, total, extratos por segundo)
+
+    Os PDFs são gravados no ZIP à medida que ficam prontos; no máximo
+    alguns lotes por processo ficam em memória ao mesmo tempo.
+    Retorna o número de extratos exportados.
+    """
+    workers = workers or os.cpu_count() or 1
+    conn = sqlite3.connect(db_path)
+    total = conn.execute('SELECT COUNT(*) FROM loans').fetchone()[0]
+
+    done = 0
+    start = time.perf_counter()
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+
+        def write_oldest():
+            nonlocal done
+            statements = pending.popleft().result()
+            for name, pdf in statements:
+                archive.writestr(name, pdf)
+            done += len(statements)
+            if progress:
+                elapsed = time.perf_counter() - start
+                progress(done, total, done / elapsed if elapsed else 0.0)
+
+        for batch in iter_statement_batches(conn, batch_size):
+            pending.append(pool.submit(render_batch, batch))
+            # Limita os lotes em andamento para manter a memória constante
+            if len(pending) >= workers * 2:
+                write_oldest()
+        while pending:
+            write_oldest()
+
+    conn.close()
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta os extratos de todos os empréstimos para um ZIP")
+    parser.add_argument('output', help="arquivo ZIP de saída ('-' para stdout)")
+    parser.add_argument('--db', default=DB_PATH, help="caminho do banco (padrão: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None, help="processos (padrão: um por núcleo)")
+    parser.add_argument('--batch-size', type=int, default=16, help="empréstimos por tarefa")
+    args = parser.parse_args(argv)
+
+    def report(done, total, rate):
+        print(f"\r{done}/{total} extratos ({rate:.1f}/s)", end='', file=sys.stderr, flush=True)
+
+    output = sys.stdout.buffer if args.output == '-' else args.output
+    start = time.perf_counter()
+    total = export_statements(output, args.db, args.workers, args.batch_size, report)
+    elapsed = time.perf_counter() - start
+    print(f"\n{total} extratos em {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
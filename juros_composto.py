@@ -1,3 +1,23 @@
+import argparse
+import csv
+import io
+import itertools
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from emprestimos.amortization import price_payment, price_schedule
+
+
+# Colunas do modo em lote
+CAMPOS_ENTRADA = ('valor', 'parcelas', 'taxa_juros_mensal')
+CAMPOS_RESUMO = ('valor_parcela', 'total_pago', 'juros')
+CAMPOS_TABELA = ('parcela', 'valor_parcela', 'juros_parcela', 'amortizacao', 'saldo')
+
+
 def calcular_emprestimo(valor, parcelas, taxa_juros_mensal):
     """
     Calcula o valor da parcela, total a ser pago e os juros de um empréstimo
@@ -13,14 +33,14 @@ def calcular_emprestimo(valor, parcelas, taxa_juros_mensal):
     juros: total de juros pagos
     """
     
+    if parcelas < 1:
+        raise ValueError(f"número de parcelas inválido: {parcelas}")
+
     # Converter taxa de juros mensal para decimal
     taxa_juros_mensal /= 100  # Ajuste para transformar em decimal
     
     # Calcular valor da parcela (Sistema Price)
-    if taxa_juros_mensal == 0:
-        valor_parcela = valor / parcelas  # Sem juros
-    else:
-        valor_parcela = valor * (taxa_juros_mensal * (1 + taxa_juros_mensal) ** parcelas) / ((1 + taxa_juros_mensal) ** parcelas - 1)
+    valor_parcela = float(price_payment(valor, taxa_juros_mensal, parcelas))
     
     # Calcular total a ser pago
     total_pago = valor_parcela * parcelas
@@ -48,5 +68,157 @@ def entrada_dados():
     print(f"Valor Total a Pagar: R$ {total_pago:.2f}")
     print(f"Total de Juros: R$ {juros:.2f}")
 
-# Chama a função de entrada
-entrada_dados()
+
+def calcular_lote(valores, parcelas, taxas_juros_mensais):
+    """
+    Versão vetorizada de calcular_emprestimo para vários empréstimos
+    Retorna arrays (valor_parcela, total_pago, juros) idênticos, bit a bit,
+    aos de calcular_emprestimo chamada linha a linha.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    parcelas = np.asarray(parcelas, dtype=np.int64)
+    taxas = np.asarray(taxas_juros_mensais, dtype=np.float64) / 100
+
+    valor_parcela = price_payment(valores, taxas, parcelas)
+    total_pago = valor_parcela * parcelas
+    return valor_parcela, total_pago, total_pago - valores
+
+
+def ler_parcelas(texto):
+    """Converte o número de parcelas de uma linha do CSV; deve ser ao menos 1"""
+    parcelas = int(texto)
+    if parcelas < 1:
+        raise ValueError(f"número de parcelas inválido: {parcelas}")
+    return parcelas
+
+
+def processar_bloco(linhas, primeira_linha, colunas, tabela=False):
+    """
+    Executado nos processos do pool: calcula um bloco de linhas do CSV e
+    retorna o trecho de CSV de saída já formatado
+    """
+    try:
+        valores = [float(linha['valor']) for linha in linhas]
+        parcelas = [ler_parcelas(linha['parcelas']) for linha in linhas]
+        taxas = [float(linha['taxa_juros_mensal']) for linha in linhas]
+    except (TypeError, ValueError):
+        # Localiza a linha inválida apenas quando há erro
+        for numero, linha in enumerate(linhas, primeira_linha):
+            try:
+                float(linha['valor']), ler_parcelas(linha['parcelas']), float(linha['taxa_juros_mensal'])
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"linha {numero}: {exc}") from None
+        raise
+
+    saida = io.StringIO()
+    writer = csv.writer(saida, lineterminator='\n')
+    originais = [[linha[coluna] for coluna in colunas] for linha in linhas]
+
+    if not tabela:
+        # repr dos floats: a saída preserva todos os dígitos do resultado
+        for original, resultado in zip(originais, zip(*calcular_lote(valores, parcelas, taxas))):
+            writer.writerow(original + [float(valor) for valor in resultado])
+        return saida.getvalue()
+
+    schedule = price_schedule(valores, np.asarray(taxas) / 100, parcelas)
+    for i, original in enumerate(originais):
+        for k in range(int(schedule['installments'][i])):
+            writer.writerow(original + [
+                k + 1,
+                float(schedule['installment'][i, k]),
+                float(schedule['interest'][i, k]),
+                float(schedule['amortization'][i, k]),
+                float(schedule['balance'][i, k]),
+            ])
+    return saida.getvalue()
+
+
+def calcular_csv(entrada, saida, tabela=False, workers=None, tamanho_bloco=None):
+    """
+    Lê empréstimos de um CSV (colunas valor, parcelas e taxa_juros_mensal;
+    as demais são repetidas na saída) e grava os resultados em CSV
+    entrada/saida: arquivos de texto
+    tabela: grava uma linha por parcela em vez do resumo do empréstimo
+    workers: processos (padrão: um por núcleo); entradas de um único bloco
+             são calculadas no próprio processo
+
+    A entrada é lida em blocos e no máximo alguns blocos por processo ficam
+    em memória; a ordem das linhas é preservada.
+    Retorna o número de empréstimos calculados.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Uma tabela completa tem até algumas centenas de linhas por empréstimo
+    tamanho_bloco = tamanho_bloco or (200 if tabela else 10000)
+
+    reader = csv.DictReader(entrada)
+    colunas = reader.fieldnames or []
+    faltando = [campo for campo in CAMPOS_ENTRADA if campo not in colunas]
+    if faltando:
+        raise ValueError(f"colunas obrigatórias ausentes: {', '.join(faltando)}")
+
+    writer = csv.writer(saida, lineterminator='\n')
+    writer.writerow(colunas + list(CAMPOS_TABELA if tabela else CAMPOS_RESUMO))
+
+    # Linha 1 é o cabeçalho
+    blocos = (
+        (bloco, 2 + i * tamanho_bloco)
+        for i, bloco in enumerate(iter(lambda: list(itertools.islice(reader, tamanho_bloco)), []))
+    )
+    primeiro = next(blocos, None)
+    if primeiro is None:
+        return 0
+    segundo = next(blocos, None)
+    if segundo is None:
+        # Entrada pequena: não compensa iniciar o pool
+        saida.write(processar_bloco(*primeiro, colunas, tabela))
+        return len(primeiro[0])
+
+    total = 0
+    pendentes = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for bloco, primeira_linha in itertools.chain([primeiro, segundo], blocos):
+            pendentes.append(pool.submit(processar_bloco, bloco, primeira_linha, colunas, tabela))
+            total += len(bloco)
+            # Limita os blocos em andamento para manter a memória constante
+            if len(pendentes) >= workers * 2:
+                saida.write(pendentes.popleft().result())
+        while pendentes:
+            saida.write(pendentes.popleft().result())
+    return total
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        # Sem argumentos: cálculo interativo de um empréstimo
+        entrada_dados()
+        return 0
+
+    parser = argparse.ArgumentParser(
+        description="Calcula em lote empréstimos lidos de um CSV (valor, parcelas, taxa_juros_mensal)"
+    )
+    parser.add_argument('entrada', help="arquivo CSV de entrada ('-' para stdin)")
+    parser.add_argument('-o', '--saida', default='-', help="arquivo CSV de saída (padrão: stdout)")
+    parser.add_argument('--tabela', action='store_true', help="grava a tabela Price completa de cada empréstimo")
+    parser.add_argument('--workers', type=int, default=None, help="processos (padrão: um por núcleo)")
+    parser.add_argument('--tamanho-bloco', type=int, default=None, help="empréstimos por tarefa")
+    args = parser.parse_args(argv)
+
+    entrada = sys.stdin if args.entrada == '-' else open(args.entrada, newline='')
+    saida = sys.stdout if args.saida == '-' else open(args.saida, 'w', newline='')
+    try:
+        total = calcular_csv(entrada, saida, args.tabela, args.workers, args.tamanho_bloco)
+    except ValueError as exc:
+        parser.exit(1, f"erro: {exc}\n")
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if saida is not sys.stdout:
+            saida.close()
+    print(f"{total} empréstimos calculados", file=sys.stderr)
+    return 0
+
+
+# Chama a função de entrada apenas quando executado como script
+if __name__ == '__main__':
+    sys.exit(main())
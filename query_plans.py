@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from emprestimos.db import DUE_PAYMENTS_SQL, LOAN_PAYMENTS_SQL, explain_query_plan, migrate
+from synthetic_db import build_database
+
+
+def check(conn, name, sql, params):
+    plan = explain_query_plan(conn, sql, params)
+    start = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    elapsed = (time.perf_counter() - start) * 1000
+    # Nenhuma tabela pode ser varrida por completo
+    ok = any('INDEX' in line for line in plan) and not any(line.startswith('SCAN') for line in plan)
+    print(f"{name}: {len(rows)} linhas em {elapsed:.2f} ms")
+    for line in plan:
+        print(f"    {line}")
+    return ok
+
+
+def main(path=None):
+    """
+    Verifica com EXPLAIN QUERY PLAN que as consultas de parcelas usam índices
+    em um banco com 1M de parcelas
+    """
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'loans_1m.db')
+    if not os.path.exists(path):
+        print(f"Gerando banco sintético em {path}...")
+        conn = build_database(path)
+    else:
+        conn = sqlite3.connect(path)
+        migrate(conn)
+    total = conn.execute('SELECT COUNT(*) FROM payments').fetchone()[0]
+    print(f"Parcelas: {total}")
+
+    ok = check(conn, 'Parcelas vencendo no dia', DUE_PAYMENTS_SQL, ('2025-09-01',))
+    ok &= check(conn, 'Parcelas do empréstimo', LOAN_PAYMENTS_SQL, (1,))
+    conn.close()
+
+    print('OK: consultas usam índices' if ok else 'FALHA: consulta sem índice')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,52 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from emprestimos.db import create_loans, migrate
+
+
+# Tamanhos padrão dos bancos de teste, em número de parcelas
+SIZES = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '1M': 1_000_000,
+}
+
+
+def build_database(path, payments=1_000_000, installments=24, paid_until='2025-06-01',
+                   seed=42, batch_size=1000):
+    """
+    Cria um banco sintético com aproximadamente `payments` parcelas
+    installments: parcelas por empréstimo
+    paid_until: parcelas que vencem antes dessa data ficam pagas
+    seed: semente dos valores, taxas e datas (o banco gerado é reprodutível)
+
+    Os empréstimos são gravados por create_loans, em lotes, então o banco tem
+    o mesmo formato (resumos, gerações) de um banco usado pelo app.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    migrate(conn)
+
+    first_start = datetime(2024, 1, 1)
+    total = max(payments // installments, 1)
+    for offset in range(0, total, batch_size):
+        create_loans(conn, [
+            {
+                'client_name': f"Cliente {i + 1}",
+                'amount_cents': rng.randrange(50_000, 5_000_000, 100),
+                'interest_rate': rng.choice((6.0, 9.5, 12.0, 18.0, 24.0, 36.0)),
+                'installments': installments,
+                'start_date': first_start + timedelta(days=rng.randrange(730)),
+            }
+            for i in range(offset, min(offset + batch_size, total))
+        ])
+
+    # Pagamentos lançados no livro, como os do app
+    with conn:
+        conn.execute(
+            "INSERT INTO payment_events (loan_id, payment_id, kind, amount_cents) "
+            "SELECT loan_id, id, 'payment', amount_cents FROM payments WHERE due_date < ? ORDER BY id",
+            (paid_until,)
+        )
+    return conn
@@ -0,0 +1,241 @@
+import argparse
+import os
+import threading
+from datetime import datetime
+
+from flask import Flask, Response, abort, flash, jsonify, redirect, render_template, request, url_for
+from werkzeug.serving import make_server
+
+from emprestimos.db import (
+    DB_PATH,
+    LOAN_EVENTS_SQL,
+    LOAN_PAYMENTS_SQL,
+    LOAN_SQL,
+    LOAN_STATUSES,
+    PORTFOLIO_SUMMARY_SQL,
+    ConnectionManager,
+    create_loans,
+    delete_payment as delete_payment_row,
+    generation,
+    loan_filters,
+    loan_paid_cents,
+    migrate,
+    toggle_payment as toggle_payment_row,
+)
+from emprestimos.metrics import InstrumentedConnection, registry
+from emprestimos.money import format_brl, to_cents
+
+
+# Quantidade padrão e máxima de empréstimos por página
+PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+app = Flask(__name__)
+app.secret_key = os.environ.get('LOANS_SECRET_KEY') or os.urandom(16)
+app.jinja_env.filters['brl'] = format_brl
+app.jinja_env.filters['date_br'] = lambda value: datetime.strptime(value[:10], '%Y-%m-%d').strftime('%d/%m/%Y')
+
+# Mesmo pool de conexões do app Streamlit; uma conexão por thread do servidor
+db = ConnectionManager(DB_PATH, factory=InstrumentedConnection)
+_migrated = threading.Event()
+
+
+def rows_as_dicts(cursor):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def pagination():
+    """
+    Página e tamanho de página pedidos em ?page= e ?per_page=
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', PER_PAGE, type=int), 1), MAX_PER_PAGE)
+    return page, per_page
+
+
+def list_filters():
+    """
+    Filtros da lista pedidos em ?q= (nome do cliente), ?status= e
+    ?start_from=/?start_to= (data de início, YYYY-MM-DD)
+    """
+    filters = {
+        'search': request.args.get('q', '').strip() or None,
+        'status': request.args.get('status') or None,
+        'start_from': request.args.get('start_from') or None,
+        'start_to': request.args.get('start_to') or None,
+    }
+    if filters['status'] not in (None,) + LOAN_STATUSES:
+        abort(400)
+    for name in ('start_from', 'start_to'):
+        if filters[name]:
+            try:
+                datetime.strptime(filters[name], '%Y-%m-%d')
+            except ValueError:
+                abort(400)
+    return filters
+
+
+def loans_page(conn, page, per_page, filters=None):
+    count_sql, page_sql, params = loan_filters(**(filters or {}))
+    total = conn.execute(count_sql, params).fetchone()[0]
+    pages = max((total - 1) // per_page + 1, 1)
+    params.update(limit=per_page, offset=(page - 1) * per_page)
+    loans = rows_as_dicts(conn.execute(page_sql, params))
+    return {'page': page, 'per_page': per_page, 'total': total, 'pages': pages, 'items': loans}
+
+
+def conditional(etag, build):
+    """
+    Responde 304 sem consultar o banco quando o cliente já tem a versão atual
+    A ETag vem dos contadores de geração, que mudam a cada escrita.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.before_request
+def ensure_schema():
+    # Migrações pendentes na primeira requisição; migrate é seguro em paralelo
+    if not _migrated.is_set():
+        migrate(db.connection())
+        _migrated.set()
+
+
+@app.route('/')
+def index():
+    conn = db.connection()
+    page, per_page = pagination()
+    context = loans_page(conn, page, per_page)
+    return render_template('index.html', loans=context.pop('items'), **context)
+
+
+@app.route('/loans/new', methods=['GET', 'POST'])
+def create_loan():
+    if request.method == 'POST':
+        try:
+            loan = {
+                'client_name': request.form['client_name'].strip(),
+                'amount_cents': to_cents(float(request.form['amount'])),
+                'interest_rate': float(request.form['interest_rate']),
+                'installments': int(request.form['installments']),
+            }
+        except (KeyError, ValueError):
+            loan = None
+        if not loan or not loan['client_name'] or loan['amount_cents'] <= 0 or loan['installments'] < 1:
+            flash("Por favor, preencha todos os campos corretamente.", 'danger')
+            return redirect(url_for('index'))
+        (loan_row, _), = create_loans(db.connection(), [loan])
+        flash("Empréstimo criado com sucesso!", 'success')
+        return redirect(url_for('view_loan', loan_id=loan_row['id']))
+    return render_template('create_loan.html')
+
+
+@app.route('/loans/<int:loan_id>')
+def view_loan(loan_id):
+    conn = db.connection()
+    loans = rows_as_dicts(conn.execute(LOAN_SQL, (loan_id,)))
+    if not loans:
+        abort(404)
+    payments = rows_as_dicts(conn.execute(LOAN_PAYMENTS_SQL, (loan_id,)))
+    return render_template('view_loan.html', loan=loans[0], payments=payments)
+
+
+@app.route('/payments/<int:payment_id>/toggle', methods=['POST'])
+def toggle_payment(payment_id):
+    # O formulário envia o estado desejado: cliques repetidos não se anulam
+    paid = request.form.get('paid', type=int)
+    loan_id = toggle_payment_row(db.connection(), payment_id, paid)
+    if loan_id is None:
+        abort(404)
+    return redirect(url_for('view_loan', loan_id=loan_id))
+
+
+@app.route('/payments/<int:payment_id>/delete', methods=['POST'])
+def delete_payment(payment_id):
+    conn = db.connection()
+    try:
+        loan_id = delete_payment_row(conn, payment_id)
+    except ValueError as exc:
+        flash(f"Não foi possível excluir a parcela: {exc}.", 'danger')
+        loan_id = conn.execute('SELECT loan_id FROM payments WHERE id = ?', (payment_id,)).fetchone()[0]
+    if loan_id is None:
+        abort(404)
+    return redirect(url_for('view_loan', loan_id=loan_id))
+
+
+@app.route('/api/loans')
+def api_loans():
+    conn = db.connection()
+    page, per_page = pagination()
+    filters = list_filters()
+    # 'overdue' depende do dia, que entra na ETag junto com os filtros
+    today = datetime.now().strftime('%Y-%m-%d')
+    etag = f"loans-{generation(conn)}-{page}-{per_page}-{today}-{request.query_string.decode()}"
+    return conditional(etag, lambda: jsonify(loans_page(conn, page, per_page, filters)))
+
+
+@app.route('/api/loans/<int:loan_id>')
+def api_loan(loan_id):
+    conn = db.connection()
+    etag = f"loan-{loan_id}-{generation(conn)}-{generation(conn, f'loan:{loan_id}')}"
+
+    def build():
+        loans = rows_as_dicts(conn.execute(LOAN_SQL, (loan_id,)))
+        if not loans:
+            abort(404)
+        payments = rows_as_dicts(conn.execute(LOAN_PAYMENTS_SQL, (loan_id,)))
+        events = rows_as_dicts(conn.execute(LOAN_EVENTS_SQL, (loan_id,)))
+        return jsonify({**loans[0], 'paid_cents': loan_paid_cents(conn, loan_id), 'payments': payments, 'events': events})
+    return conditional(etag, build)
+
+
+@app.route('/api/portfolio')
+def api_portfolio():
+    conn = db.connection()
+
+    def build():
+        rows = rows_as_dicts(conn.execute(PORTFOLIO_SUMMARY_SQL))
+        return jsonify(rows[0] if rows else {
+            'loan_count': 0, 'principal_cents': 0, 'paid_cents': 0, 'outstanding_cents': 0,
+        })
+    return conditional(f"portfolio-{generation(conn)}", build)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(registry.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.errorhandler(404)
+def not_found(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'não encontrado'}), 404
+    return error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP (HTML e JSON) da carteira de empréstimos")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    # Servidor WSGI com uma thread por requisição
+    server = make_server(args.host, args.port, app, threaded=True)
+    print(f"Servindo em http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()